@@ -0,0 +1,141 @@
+# encoding: utf-8
+
+import argparse
+import json
+import os
+import time
+import sys
+
+import numpy as np
+
+from auto_module.classifier import StateClassifier
+from auto_module.compiled import CompiledConfig
+from auto_module.image import read_gray_img, ThreadPoolMatcher
+from auto_module.logger import get_logger
+from auto_module.model import read_game_config_file, GAME_CONFIG_FILENAME, GameConfig
+
+BENCHMARK_NO_STATE_LABEL = '_NONE'  # screenshots in this dir should not be classified as any state
+BENCHMARK_IMG_EXTENSIONS = ('.png', '.jpg', '.bmp')
+BENCHMARK_PERCENTILES = [50, 90, 99]
+
+logger = get_logger('benchmark')
+
+
+def load_labelled_frames(frame_dir):
+    """
+    Screenshots labelled by the dir they are in: $frame_dir/<state name>/*.png,
+      or $frame_dir/$BENCHMARK_NO_STATE_LABEL/*.png for screenshots without any state
+    :return: [(frame path, state name or None, gray frame), ...]
+    """
+    frame_list = []
+    for label in sorted(os.listdir(frame_dir)):
+        label_dir = os.path.join(frame_dir, label)
+        if not os.path.isdir(label_dir):
+            continue
+        state_name = None if label == BENCHMARK_NO_STATE_LABEL else label
+        for frame_name in sorted(os.listdir(label_dir)):
+            if frame_name.lower().endswith(BENCHMARK_IMG_EXTENSIONS):
+                frame_path = os.path.join(label_dir, frame_name)
+                frame_list.append((frame_path, state_name, read_gray_img(frame_path)))
+    return frame_list
+
+
+class CountingMatcher(ThreadPoolMatcher):
+    def __init__(self):
+        """
+        ThreadPoolMatcher counting the submitted template jobs. The jobs still running when the state is decided
+          are not written into the hit table, but they are matched all the same
+        """
+        super().__init__()
+        self.job_count = 0
+
+    def submit_all(self, src_img, job_list):
+        self.job_count += len(job_list)
+        return super().submit_all(src_img, job_list)
+
+
+def run_benchmark(game_config: GameConfig, frame_list, parallel=False, repeat=1):
+    """
+    Classify every frame the way Executor.judge_state does for a screenshot without a previous one
+    :param frame_list: see load_labelled_frames
+    :param parallel: match the templates on a ThreadPoolMatcher like the executor with PARALLEL_MATCH_ENABLED
+    :param repeat: classify every frame this many times, the latencies of all the runs are reported
+    :return: report dict, see format_report. templates_per_frame counts the submitted jobs if parallel
+    """
+    game_config.prepare()
+    matcher = CountingMatcher() if parallel else None
+    classifier = StateClassifier(CompiledConfig(game_config), matcher)
+    latency_list = []
+    template_num_list = []
+    confusion_dict = {}  # label -> predicted state -> count
+    error_list = []
+    try:
+        for _ in range(repeat):
+            for frame_path, label, frame in frame_list:
+                if matcher is not None:
+                    matcher.job_count = 0
+                start_time = time.perf_counter()
+                result, _ = classifier.classify(frame)
+                latency_list.append(time.perf_counter() - start_time)
+                template_num_list.append(matcher.job_count if matcher is not None else len(classifier.last_hit_table))
+
+                predicted_dict = confusion_dict.setdefault(str(label), {})
+                predicted_dict[str(result)] = predicted_dict.get(str(result), 0) + 1
+                if result != label:
+                    error_list.append({'frame': frame_path, 'label': label, 'result': result})
+    finally:
+        if matcher is not None:
+            matcher.shutdown()
+
+    if len(latency_list) == 0:
+        return {'frames': 0}
+    latency_ms = np.array(latency_list) * 1000
+    return {
+        'frames': len(latency_list),
+        'accuracy': 1 - len(error_list) / len(latency_list),
+        'latency_ms': dict([('mean', float(latency_ms.mean())), ('max', float(latency_ms.max()))] +
+                           [('p{0}'.format(p), float(np.percentile(latency_ms, p))) for p in BENCHMARK_PERCENTILES]),
+        'templates_per_frame': {'mean': float(np.mean(template_num_list)), 'max': int(np.max(template_num_list))},
+        'confusion': confusion_dict,
+        'errors': error_list,
+    }
+
+
+def format_report(report):
+    if report['frames'] == 0:
+        return 'No frames'
+    line_list = [
+        'frames: {0}'.format(report['frames']),
+        'accuracy: {0:.2%}'.format(report['accuracy']),
+        'latency (ms): ' + ', '.join('{0} {1:.2f}'.format(k, v) for k, v in report['latency_ms'].items()),
+        'templates per frame: mean {0:.1f}, max {1}'.format(report['templates_per_frame']['mean'],
+                                                           report['templates_per_frame']['max']),
+        'confusion (label -> result: count):',
+    ]
+    for label, predicted_dict in sorted(report['confusion'].items()):
+        line_list.append('  {0} -> '.format(label) + ', '.join(
+            '{0}: {1}'.format(k, v) for k, v in sorted(predicted_dict.items(), key=lambda x: -x[1])))
+    for error in report['errors']:
+        line_list.append('wrong: {0} is {1}, classified as {2}'.format(error['frame'], error['label'], error['result']))
+    return '\n'.join(line_list)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the state classification on labelled screenshots')
+    parser.add_argument('config_dir', help='dir containing config.json, e.g. game_tools/Arknights/1920x1080')
+    parser.add_argument('frame_dir', help='dir with one sub dir of screenshots per state name, '
+                                          'and {0} for screenshots without any state'.format(BENCHMARK_NO_STATE_LABEL))
+    parser.add_argument('--parallel', action='store_true', help='match the templates on a thread pool')
+    parser.add_argument('--repeat', type=int, default=1, help='classify every screenshot this many times')
+    parser.add_argument('--json', help='also write the report to this json file')
+    parser.add_argument('--min-accuracy', type=float, default=None, help='exit with 1 below this accuracy')
+    args = parser.parse_args()
+
+    config = read_game_config_file(args.config_dir, GAME_CONFIG_FILENAME)
+    r = run_benchmark(config, load_labelled_frames(args.frame_dir), args.parallel, args.repeat)
+    print(format_report(r))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(r, f, indent=4, ensure_ascii=False)
+    if args.min_accuracy is not None and r['frames'] > 0 and r['accuracy'] < args.min_accuracy:
+        sys.exit(1)
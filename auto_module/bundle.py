@@ -0,0 +1,128 @@
+# encoding: utf-8
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from auto_module.image import read_gray_img
+from auto_module.logger import get_logger
+
+BUNDLE_FILENAME = 'templates.bundle'
+BUNDLE_MAGIC = b'AGTB'
+BUNDLE_VERSION = 1
+BUNDLE_ALIGNMENT = 64  # byte alignment of the header end and of every image in the data section
+BUNDLE_IMG_EXTENSIONS = ('.png',)
+
+logger = get_logger('bundle')
+
+
+def align(n):
+    return (n + BUNDLE_ALIGNMENT - 1) // BUNDLE_ALIGNMENT * BUNDLE_ALIGNMENT
+
+
+def build_bundle(config_dir):
+    """
+    Pack the gray images of all the states under config_dir into $BUNDLE_FILENAME.
+    File layout: magic, version and header length (uint32 little endian each), the json header,
+      then the raw uint8 images. The PNG files stay the editable source of the images
+    :return: path of the bundle
+    """
+    image_list = []
+    offset = 0
+    for state_dir in sorted(os.listdir(config_dir)):
+        state_path = os.path.join(config_dir, state_dir)
+        if not os.path.isdir(state_path):
+            continue
+        for img_name in sorted(os.listdir(state_path)):
+            if not img_name.lower().endswith(BUNDLE_IMG_EXTENSIONS):
+                continue
+            img_path = os.path.join(state_path, img_name)
+            mtime = os.path.getmtime(img_path)
+            img = read_gray_img(img_path)
+            image_list.append(({
+                'path': state_dir + '/' + img_name,
+                'offset': offset,
+                'width': img.shape[1],
+                'height': img.shape[0],
+                'mtime': mtime,
+                'key': '{0}x{1}:{2}'.format(img.shape[1], img.shape[0], hashlib.md5(img.tobytes()).hexdigest()),
+            }, img))
+            offset = align(offset + img.nbytes)
+
+    header = json.dumps({'images': [info for info, _ in image_list]}, ensure_ascii=False).encode('utf-8')
+    prefix_size = len(BUNDLE_MAGIC) + 8
+    header += b' ' * (align(prefix_size + len(header)) - prefix_size - len(header))
+
+    bundle_path = os.path.join(config_dir, BUNDLE_FILENAME)
+    tmp_path = bundle_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(struct.pack('<II', BUNDLE_VERSION, len(header)))
+        f.write(header)
+        data_start = f.tell()
+        for info, img in image_list:
+            f.seek(data_start + info['offset'])
+            f.write(np.ascontiguousarray(img).tobytes())
+    os.replace(tmp_path, bundle_path)
+    logger.info('{0} images packed into {1}'.format(len(image_list), bundle_path))
+    return bundle_path
+
+
+class TemplateBundle:
+    def __init__(self, config_dir):
+        """
+        Memory mapped $BUNDLE_FILENAME of a config dir, see build_bundle
+        """
+        self.config_dir = config_dir
+        self.path = os.path.join(config_dir, BUNDLE_FILENAME)
+        self.info_dict = {}  # absolute image path -> image info in the header
+        self.data = None
+        with open(self.path, 'rb') as f:
+            magic = f.read(len(BUNDLE_MAGIC))
+            version, header_size = struct.unpack('<II', f.read(8))
+            if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+                raise ValueError('Not a version {0} template bundle: {1}'.format(BUNDLE_VERSION, self.path))
+            header = json.loads(f.read(header_size).decode('utf-8'))
+            data_start = f.tell()
+        for info in header['images']:
+            state_dir, img_name = info['path'].split('/')
+            self.info_dict[os.path.abspath(os.path.join(config_dir, state_dir, img_name))] = info
+        if data_start < os.path.getsize(self.path):
+            self.data = np.memmap(self.path, dtype=np.uint8, mode='r', offset=data_start)
+
+    def get(self, img_path, mtime):
+        """
+        :param mtime: current mtime of the PNG file
+        :return: read-only gray image and its content key, or None if it is not packed or the PNG is newer
+        """
+        info = self.info_dict.get(os.path.abspath(img_path))
+        if info is None or mtime > info['mtime']:
+            return None
+        size = info['width'] * info['height']
+        img = self.data[info['offset']:info['offset'] + size].reshape(info['height'], info['width'])
+        return img, info['key']
+
+
+def load_bundle(config_dir):
+    """
+    :return: TemplateBundle of the config dir, or None if it does not exist or is broken
+    """
+    if not os.path.isfile(os.path.join(config_dir, BUNDLE_FILENAME)):
+        return None
+    try:
+        return TemplateBundle(config_dir)
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning('Failed to load template bundle of {0}: {1}'.format(config_dir, e))
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack the template images of game configs into bundles')
+    parser.add_argument('config_dirs', nargs='+', help='dirs containing config.json, e.g. game_tools/Arknights/1920x1080')
+    args = parser.parse_args()
+    for d in args.config_dirs:
+        build_bundle(d)
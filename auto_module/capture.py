@@ -0,0 +1,356 @@
+# encoding: utf-8
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from mss import mss
+except ImportError:  # only MssCapture needs it
+    mss = None
+
+from auto_module.constant import CAPTURE_COLOR
+from auto_module.exception import CaptureBackendException
+from auto_module.logger import get_logger
+from auto_module.profiler import profiler
+
+logger = get_logger('capture')
+
+REPLAY_IMG_EXTENSIONS = ('.png', '.jpg', '.bmp')
+CAPTURE_PRODUCER_FPS = 20  # max frames grabbed per second by CaptureProducer
+CAPTURE_RING_SIZE = 4  # frames kept by CaptureProducer
+CAPTURE_TIMEOUT = 5  # seconds CaptureProducer.grab waits for a frame, e.g. while the window is minimized
+CAPTURE_CHANGE_SAMPLE_STEP = 8  # CaptureProducer tells changed frames by every this many pixels in both directions
+
+
+def convert_color(img, color):
+    """
+    Convert a gray, BGR or BGRA frame into the color of CAPTURE_COLOR
+    """
+    if len(img.shape) == 2:
+        if color == CAPTURE_COLOR['GRAY']:
+            return img
+        code = cv2.COLOR_GRAY2BGR
+    elif img.shape[2] == 4:
+        code = cv2.COLOR_BGRA2GRAY if color == CAPTURE_COLOR['GRAY'] else cv2.COLOR_BGRA2BGR
+    else:
+        if color == CAPTURE_COLOR['BGR']:
+            return img
+        code = cv2.COLOR_BGR2GRAY
+    with profiler.stage('gray_conversion'):
+        return cv2.cvtColor(img, code)
+
+
+class CaptureBackend:
+    def __init__(self, color=CAPTURE_COLOR['GRAY']):
+        """
+        A source of game frames. The Executor only depends on this interface,
+          so it can run on any platform the backend supports
+        :param color: CAPTURE_COLOR of the frames returned by grab()
+        """
+        self.color = color
+
+    def grab(self):
+        """
+        :return: frame as a numpy array, and the timestamp when it was captured
+        """
+        raise NotImplementedError
+
+    def grab_newer(self, t, timeout=None):
+        """
+        :param t: timestamp, e.g. when an action was executed
+        :return: a frame captured after t and its timestamp.
+                 Backends capturing when called have nothing older to return, so the default grabs
+        """
+        return self.grab()
+
+    def get_shape(self):
+        """
+        :return: width, height
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GameWindowCapture(CaptureBackend):
+    def __init__(self, game_window, color=CAPTURE_COLOR['GRAY']):
+        """
+        Capture a win32 window with GameWindow.game_screenshot
+        """
+        super().__init__(color)
+        self.game_window = game_window
+
+    def grab(self):
+        return self.game_window.game_screenshot(self.color), time.time()
+
+    def get_shape(self):
+        return self.game_window.get_shape()
+
+
+class MssCapture(CaptureBackend):
+    def __init__(self, left, top, width, height, color=CAPTURE_COLOR['GRAY']):
+        """
+        Capture a region of the screen with mss, works on Linux/X11, macOS and Windows
+        :param left: left of the region on the screen
+        :param top: top of the region on the screen
+        """
+        super().__init__(color)
+        if mss is None:
+            raise CaptureBackendException('MssCapture needs the mss package')
+        self.sct = mss()
+        self.monitor = {'left': left, 'top': top, 'width': width, 'height': height}
+
+    def grab(self):
+        shot = self.sct.grab(self.monitor)
+        timestamp = time.time()
+        return convert_color(np.asarray(shot), self.color), timestamp
+
+    def get_shape(self):
+        return self.monitor['width'], self.monitor['height']
+
+    def close(self):
+        self.sct.close()
+
+
+class ReplayCapture(CaptureBackend):
+    def __init__(self, path, interval=None, loop=False, color=CAPTURE_COLOR['GRAY']):
+        """
+        Replay recorded frames from a dir of images (in file name order) or a video file
+        :param path: dir of images or video file
+        :param interval: seconds between two frames. If given, grab() returns the frame of the elapsed time
+                         like a live stream, otherwise each grab() returns the next frame. See realtime() for videos
+        :param loop: restart from the first frame at the end, otherwise the last frame is kept
+        """
+        super().__init__(color)
+        self.path = path
+        self.interval = interval
+        self.loop = loop
+        self.img_path_list = []
+        self.video = None
+        self.frame_num = 0
+        if os.path.isdir(path):
+            self.img_path_list = sorted(os.path.join(path, name) for name in os.listdir(path)
+                                        if name.lower().endswith(REPLAY_IMG_EXTENSIONS))
+            self.frame_num = len(self.img_path_list)
+        elif os.path.isfile(path):
+            self.video = cv2.VideoCapture(path)
+            if not self.video.isOpened():
+                raise CaptureBackendException('Cannot open video {0}'.format(path))
+            self.frame_num = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        if self.frame_num == 0:
+            raise CaptureBackendException('No frame found in {0}'.format(path))
+
+        self.start_time = None
+        self.frame_index = -1  # index of the last returned frame
+        self.frame = None
+        self.video_index = -1  # index of the last frame read from the video
+        logger.info('replay {0} frames from {1}'.format(self.frame_num, path))
+
+    def realtime(self):
+        """
+        Replay the video at its recorded fps
+        """
+        if self.video is not None:
+            fps = self.video.get(cv2.CAP_PROP_FPS)
+            self.interval = 1 / fps if fps > 0 else None
+        return self
+
+    def finished(self):
+        return not self.loop and self.frame_index >= self.frame_num - 1
+
+    def next_index(self):
+        if self.interval is None:
+            index = self.frame_index + 1
+        else:
+            if self.start_time is None:
+                self.start_time = time.time()
+            index = int((time.time() - self.start_time) / self.interval)
+        if self.loop:
+            return index % self.frame_num
+        return min(index, self.frame_num - 1)
+
+    def read_frame(self, index):
+        if self.video is None:
+            img_path = self.img_path_list[index]
+            return cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+        if index <= self.video_index:  # looped, or the same frame again
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self.video_index = index - 1
+        img = None
+        while self.video_index < index:
+            ok, img = self.video.read()
+            if not ok:
+                raise CaptureBackendException('Failed to read frame {0} of {1}'.format(index, self.path))
+            self.video_index += 1
+        return img
+
+    def grab(self):
+        index = self.next_index()
+        if index != self.frame_index or self.frame is None:
+            self.frame = convert_color(self.read_frame(index), self.color)
+            self.frame_index = index
+        return self.frame, time.time()
+
+    def get_shape(self):
+        img = self.frame if self.frame is not None else self.read_frame(0)
+        return img.shape[1], img.shape[0]
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+
+class CaptureProducer(CaptureBackend):
+    def __init__(self, backend: CaptureBackend, fps=CAPTURE_PRODUCER_FPS, buffer_num=CAPTURE_RING_SIZE, waiter=None,
+                 timeout=CAPTURE_TIMEOUT):
+        """
+        Grab frames from the backend on a background thread into a ring buffer of preallocated arrays,
+          so capturing overlaps with the matching on the consumer thread.
+        Frames get increasing frame ids. latest() and wait_newer() copy them into buffer_num preallocated
+          output arrays in turn, so a returned frame stays valid until buffer_num newer frames are returned.
+          Copy it to keep it longer or to hand it to another thread
+        :param fps: max frames grabbed per second
+        :param buffer_num: frames kept in the ring buffer
+        :param waiter: AdaptiveWaiter woken up whenever the grabbed frame differs from the previous one.
+                       Once it is backed off to the max, the producer grabs no faster than it polls
+                       unless a consumer waits for a new frame
+        :param timeout: seconds grab() waits for a frame before raising CaptureBackendException
+        """
+        super().__init__(backend.color)
+        self.backend = backend
+        self.interval = 1 / fps if fps else 0
+        self.waiter = waiter
+        self.timeout = timeout
+        self.ring = [None] * buffer_num  # preallocated frame arrays
+        self.ring_info = [None] * buffer_num  # (frame id, timestamp) of the frame in the same slot
+        self.output_ring = [None] * buffer_num  # preallocated arrays handed out to the consumers
+        self.output_index = 0
+        self.frame_id = 0  # id of the latest frame, 0 before the first one
+        self.prev_sample = None  # subsampled copy of the latest frame, see publish
+        self.condition = threading.Condition()
+        self.grab_event = threading.Event()  # set by the consumers waiting for a new frame
+        self.error = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def get_interval(self):
+        """
+        :return: seconds between two grabs. The interval of the waiter once it is backed off to the max,
+                 i.e. the screen has been static for a while, so an idle game costs as few grabs as polls
+        """
+        if self.waiter is None or self.waiter.interval < self.waiter.max_interval:
+            return self.interval
+        return max(self.interval, self.waiter.interval)
+
+    def run(self):
+        while self.running:
+            start_time = time.time()
+            try:
+                frame, timestamp = self.backend.grab()
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                logger.warning('Capture producer stopped: {0}'.format(e))
+                return
+            if frame is not None:
+                self.publish(frame, timestamp)
+            self.grab_event.wait(max(0.0, self.get_interval() - (time.time() - start_time)))
+            self.grab_event.clear()
+
+    def publish(self, frame, timestamp):
+        slot = self.frame_id % len(self.ring)
+        # comparing the full frames costs milliseconds at every grab, a sample is enough to wake the waiter
+        sample = frame[::CAPTURE_CHANGE_SAMPLE_STEP, ::CAPTURE_CHANGE_SAMPLE_STEP]
+        changed = self.prev_sample is None or self.prev_sample.shape != sample.shape \
+            or not np.array_equal(self.prev_sample, sample)
+        if changed:
+            self.prev_sample = sample.copy()
+        with self.condition:
+            # consumers copy the slots while holding the condition, so the slot is not read while written
+            if self.ring[slot] is None or self.ring[slot].shape != frame.shape or self.ring[slot].dtype != frame.dtype:
+                self.ring[slot] = np.empty_like(frame)
+            np.copyto(self.ring[slot], frame)
+            self.ring_info[slot] = (self.frame_id + 1, timestamp)
+            self.frame_id += 1
+            self.condition.notify_all()
+        if changed and self.waiter is not None:
+            self.waiter.wake()
+
+    def check_error(self):
+        if self.error is not None:
+            raise CaptureBackendException('Capture failed: {0}'.format(self.error))
+
+    def copy_out(self, slot):
+        """
+        Copy the frame of the slot into the next output array, the condition must be held
+        """
+        frame = self.ring[slot]
+        output = self.output_ring[self.output_index]
+        if output is None or output.shape != frame.shape or output.dtype != frame.dtype:
+            output = self.output_ring[self.output_index] = np.empty_like(frame)
+        self.output_index = (self.output_index + 1) % len(self.output_ring)
+        np.copyto(output, frame)
+        return output
+
+    def latest(self, timeout=None):
+        """
+        :return: the latest frame, its frame id and timestamp. Waits for the first frame if needed
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frame_id > 0 or self.error is not None, timeout):
+                raise CaptureBackendException('No frame captured in {0} seconds'.format(timeout))
+            self.check_error()
+            slot = (self.frame_id - 1) % len(self.ring)
+            frame_id, timestamp = self.ring_info[slot]
+            return self.copy_out(slot), frame_id, timestamp
+
+    def wait_newer(self, t, timeout=None):
+        """
+        :param t: timestamp, e.g. when an action was executed
+        :return: the first frame captured after t, its frame id and timestamp
+        """
+        def _find():
+            for frame_id in range(max(1, self.frame_id - len(self.ring) + 1), self.frame_id + 1):
+                slot = (frame_id - 1) % len(self.ring)
+                if self.ring_info[slot][1] > t:
+                    return slot
+            return None
+
+        self.grab_event.set()  # do not wait for the backed off interval
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.error is not None or _find() is not None, timeout):
+                raise CaptureBackendException('No frame newer than {0} captured in {1} seconds'.format(t, timeout))
+            self.check_error()
+            slot = _find()
+            frame_id, timestamp = self.ring_info[slot]
+            return self.copy_out(slot), frame_id, timestamp
+
+    def grab(self):
+        frame, _, timestamp = self.latest(self.timeout)
+        return frame, timestamp
+
+    def grab_newer(self, t, timeout=None):
+        try:
+            frame, _, timestamp = self.wait_newer(t, timeout)
+        except CaptureBackendException:
+            self.check_error()
+            logger.warning('No frame newer than {0} captured, take the latest one'.format(t))
+            return self.grab()
+        return frame, timestamp
+
+    def get_shape(self):
+        return self.backend.get_shape()
+
+    def close(self):
+        self.running = False
+        self.grab_event.set()
+        self.thread.join()
+        self.backend.close()
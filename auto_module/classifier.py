@@ -0,0 +1,354 @@
+# encoding: utf-8
+
+import itertools
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from auto_module.image import get_gray_resource_img, get_gray_resource_img_key, get_matched_area, ThreadPoolMatcher, \
+    get_matched_area_in_region, check_area_intersect
+from auto_module.logger import get_logger
+from auto_module.profiler import profiler
+from auto_module.compiled import CompiledConfig, StateTypeCode
+from auto_module.condition import ConditionClause, ConditionExpression
+from typing import Dict, List, Tuple
+
+logger = get_logger('classifier')
+
+
+class StateClassifier:
+    def __init__(self, runtime: CompiledConfig, matcher: ThreadPoolMatcher = None):
+        """
+        Classify screenshots against all the states of a game config.
+        Condition templates are deduplicated by content across states, and each of them is
+          matched at most once per screenshot, no matter how many states use it
+
+        :param runtime: the compiled game config
+        :param matcher: if given, the templates are matched in parallel on it
+        """
+        self.runtime = runtime
+        self.matcher = matcher
+        # template key -> (resource dir, resource name)
+        self.template_dict = {}  # type: Dict[str, Tuple[str, str]]
+        # state name -> [(template key, not flag), ...]
+        self.state_condition_dict = {}  # type: Dict[str, List[Tuple[str, bool]]]
+        # state name -> (condition expression, {clause: template key})
+        self.state_expr_dict = {}  # type: Dict[str, Tuple[ConditionExpression, Dict[ConditionClause, str]]]
+        # state name -> [(template key, not flag), ...] of the conditions telling the state apart from the others
+        self.state_discriminating_dict = {}  # type: Dict[str, List[Tuple[str, bool]]]
+        self.last_hit_table = {}
+        self.prev_hit_table = {}  # hit table of the previous screenshot, used with the changed areas
+        self.changed_area_list = None
+        self.compile()
+
+    def compile(self):
+        self.template_dict.clear()
+        self.state_condition_dict.clear()
+        self.state_expr_dict.clear()
+        self.state_discriminating_dict.clear()
+        condition_num = 0
+        for state in self.runtime.states:
+            condition_list = []
+            clause_key_dict = {}
+            for condition in state.conditions:
+                key = get_gray_resource_img_key(condition.resource_dir, condition.resource_name)
+                if key not in self.template_dict:
+                    self.template_dict[key] = (condition.resource_dir, condition.resource_name)
+                    profiler.set_label(key, state.name + '/' + condition.resource_name)
+                condition_list.append((key, condition.not_flag))
+                clause_key_dict[condition.clause] = key
+                condition_num += 1
+            self.state_condition_dict[state.name] = condition_list
+            self.state_expr_dict[state.name] = (state.condition_expr, clause_key_dict)
+
+        # template key -> number of states which need the template in the screenshot
+        required_count_dict = {}
+        for condition_list in self.state_condition_dict.values():
+            for key in set(key for key, not_flag in condition_list if not not_flag):
+                required_count_dict[key] = required_count_dict.get(key, 0) + 1
+        for state_name, condition_list in self.state_condition_dict.items():
+            self.state_discriminating_dict[state_name] = self.get_discriminating_list(condition_list,
+                                                                                      required_count_dict)
+        logger.info('{0} conditions of {1} states compiled into {2} templates'
+                    .format(condition_num, len(self.state_condition_dict), len(self.template_dict)))
+
+    @staticmethod
+    def get_discriminating_list(condition_list, required_count_dict):
+        """
+        Conditions telling the state apart from the others, best first: the !templates, which are written to tell
+          the state from a screen looking the same, then the templates no other state needs, then the rest
+        :return: the conditions of condition_list in the best of these tiers
+        """
+        def get_tier(condition):
+            key, not_flag = condition
+            if not_flag:
+                return 0
+            return 1 if required_count_dict[key] == 1 else 2
+
+        if len(condition_list) == 0:
+            return []
+        best_tier = min(get_tier(c) for c in condition_list)
+        return [c for c in condition_list if get_tier(c) == best_tier]
+
+    def get_template_img(self, key):
+        resource_dir, resource_name = self.template_dict[key]
+        return get_gray_resource_img(resource_dir, resource_name)
+
+    def plan_template(self, key):
+        """
+        Decide how to match the template when the screenshot only changed in self.changed_area_list
+          since the previous one
+        :return: (True, rect) if the result of the previous screenshot is still valid,
+                 (False, region) to search in the region only, or (False, None) to search everywhere
+        """
+        if self.changed_area_list is None or key not in self.prev_hit_table:
+            return False, None
+        rect = self.prev_hit_table[key]
+        if rect is not None:
+            for area in self.changed_area_list:
+                if check_area_intersect(rect, area):
+                    return False, None
+            return True, rect
+
+        # the template was not there, so it can only appear overlapping the changed areas
+        if len(self.changed_area_list) == 0:
+            return True, None
+        h, w = self.get_template_img(key).shape[:2]
+        return False, (min(a[0] for a in self.changed_area_list) - w, min(a[1] for a in self.changed_area_list) - h,
+                       max(a[2] for a in self.changed_area_list) + w, max(a[3] for a in self.changed_area_list) + h)
+
+    def match_template(self, key, src_img, hit_table):
+        """
+        :return: the matched area of the template, or None. Cached in the hit_table
+        """
+        if key not in hit_table:
+            reuse, r = self.plan_template(key)
+            if reuse:
+                hit_table[key] = r
+            elif r is not None:
+                hit_table[key] = get_matched_area_in_region(src_img, self.get_template_img(key), r, key)
+            else:
+                hit_table[key] = get_matched_area(src_img, self.get_template_img(key), key)
+        return hit_table[key]
+
+    def new_hit_table(self, changed_area_list, hit_table=None):
+        """
+        Start the hit table of a new screenshot, the matches outside changed_area_list are taken from the last one
+        :param hit_table: matches of the screenshot so far. Nothing changes if it is the current hit table already
+        """
+        if hit_table is not None and hit_table is self.last_hit_table:
+            return hit_table
+        self.prev_hit_table = self.last_hit_table
+        self.changed_area_list = changed_area_list
+        self.last_hit_table = hit_table if hit_table is not None else {}
+        return self.last_hit_table
+
+    def check_state(self, state_name, src_img, hit_table) -> Tuple[bool, list]:
+        """
+        The same as GameState.check_if_conditions_met, but the templates already in the hit_table are checked first
+        """
+        expr, clause_key_dict = self.state_expr_dict[state_name]
+        return expr.evaluate(lambda c: self.match_template(clause_key_dict[c], src_img, hit_table),
+                             lambda c: clause_key_dict[c] in hit_table)
+
+    def spot_check_state(self, state_name, src_img, hit_table) -> Tuple[bool, list]:
+        """
+        Check only the cheapest discriminating condition of the state, see get_discriminating_list.
+        It is free if the template is in the hit_table already, and one template match otherwise
+        :return: the same as check_state, with the matched area of that condition only
+        """
+        discriminating_list = self.state_discriminating_dict[state_name]
+        if len(discriminating_list) == 0:
+            return False, []
+        key, not_flag = min(discriminating_list,
+                            key=lambda c: (c[0] not in hit_table, self.get_template_img(c[0]).size))
+        rect = self.match_template(key, src_img, hit_table)
+        if not_flag == (rect is not None):
+            return False, []
+        return True, [rect] if rect is not None else []
+
+    def resolve_state(self, state_name, hit_table):
+        """
+        Resolve the conditions of the state with the templates matched so far
+        :return: True or False if it is decided, None if some templates are still needed
+        """
+        condition_list = self.state_condition_dict[state_name]
+        if len(condition_list) == 0:
+            return False
+        decided = True
+        for key, not_flag in condition_list:
+            if key not in hit_table:
+                decided = False
+            elif not_flag == (hit_table[key] is not None):
+                return False
+        return True if decided else None
+
+    def get_ordered_state_list(self, candidate_list):
+        state_list = []
+        visited_set = set()
+        for state_name in itertools.chain(candidate_list, self.state_condition_dict.keys()):
+            if state_name in visited_set or state_name not in self.state_condition_dict:
+                continue
+            visited_set.add(state_name)
+            state_list.append(state_name)
+        return state_list
+
+    def classify(self, src_img, candidate_list=(), changed_area_list=None, hit_table=None) -> Tuple[str, list]:
+        """
+        Find the first state whose conditions are met by the src_img
+        :param src_img: gray screenshot
+        :param candidate_list: state names to check first, the other states are checked afterwards
+        :param changed_area_list: areas changed since the previously classified screenshot, see FrameChangeDetector.
+                                  Results of templates outside of them are reused. None if unknown
+        :param hit_table: template key -> matched area of src_img known so far, filled by the classification
+        :return: state name and the matched rect list, or None and [] if no state matched
+        """
+        state_list = self.get_ordered_state_list(candidate_list)
+        hit_table = self.new_hit_table(changed_area_list, hit_table)
+        if self.matcher is not None:
+            candidate_count = len(set(candidate_list) & self.state_condition_dict.keys())
+            return self.classify_parallel(src_img, state_list, hit_table, candidate_count)
+
+        for state_name in state_list:
+            r = self.check_state(state_name, src_img, hit_table)
+            if r[0]:
+                return state_name, r[1]
+        return None, []
+
+    def plan_jobs(self, state_list, hit_table, planned_set):
+        """
+        Reuse the template results of hit_table, and list the templates which have to be matched for state_list
+        :param planned_set: template keys planned so far, they are skipped and the new ones are added
+        :return: [(anchor key, template, region or None), ...]
+        """
+        job_list = []
+        for state_name in state_list:
+            for key, _ in self.state_condition_dict[state_name]:
+                if key in planned_set or key in hit_table:
+                    continue
+                planned_set.add(key)
+                reuse, r = self.plan_template(key)
+                if reuse:
+                    hit_table[key] = r
+                else:
+                    job_list.append((key, self.get_template_img(key), r))
+        return job_list
+
+    def classify_parallel(self, src_img, state_list, hit_table, candidate_count=0) -> Tuple[str, list]:
+        """
+        Match the templates on the matcher, and stop as soon as
+          the first state in state_list whose conditions are met is decided.
+        The templates of the first candidate_count states are submitted first, the others only after
+          all of those states are decided to be unmet
+        """
+        planned_set = set()
+        wave_list = [self.plan_jobs(state_list[:candidate_count], hit_table, planned_set),
+                     self.plan_jobs(state_list[candidate_count:], hit_table, planned_set)]
+
+        result, undecided_index = self.resolve_first_state(state_list, hit_table, 0)
+        future_dict = {}
+        try:
+            wave_index = 0
+            while result is None and undecided_index < len(state_list):
+                if wave_index < len(wave_list) and (wave_index == 0 or undecided_index >= candidate_count):
+                    future_dict.update(self.matcher.submit_all(src_img, wave_list[wave_index]))
+                    wave_index += 1
+                    continue
+                pending_list = [future for future in future_dict if future_dict[future] not in hit_table]
+                if len(pending_list) == 0:
+                    break
+                done_set, _ = wait(pending_list, return_when=FIRST_COMPLETED)
+                for future in done_set:
+                    hit_table[future_dict[future]] = future.result()
+                result, undecided_index = self.resolve_first_state(state_list, hit_table, undecided_index)
+        finally:
+            # the state is decided, the jobs still queued are not needed
+            self.matcher.cancel_all(future_dict)
+
+        if result is None:
+            return None, []
+        return result, self.check_state(result, src_img, hit_table)[1]
+
+    def resolve_first_state(self, state_list, hit_table, start_index):
+        """
+        Skip the states which are decided to be unmet from start_index
+        :return: the first state which is decided to be met or None, and the index of the first undecided state
+        """
+        index = start_index
+        while index < len(state_list):
+            r = self.resolve_state(state_list[index], hit_table)
+            if r is None:
+                return None, index
+            if r:
+                return state_list[index], index
+            index += 1
+        return None, index
+
+    def classify_all(self, src_img) -> Dict[str, list]:
+        """
+        Resolve every state from one hit table
+        :return: {state name: matched rect list} of all the states whose conditions are met
+        """
+        hit_table = self.new_hit_table(None)
+        result = {}
+        for state_name in self.state_condition_dict.keys():
+            r = self.check_state(state_name, src_img, hit_table)
+            if r[0]:
+                result[state_name] = r[1]
+        return result
+
+
+class TransitionModel:
+    def __init__(self, runtime: CompiledConfig):
+        """
+        Order the candidate states of a screenshot by how likely they follow the previous state:
+          the expected state, the successors observed so far, the jump states, then the rest,
+          i.e. the previous state itself and the successors in the config graph.
+        StateClassifier checks all the other states afterwards
+        """
+        self.runtime = runtime
+        # state name -> [[next state name, count], ...] in descending count order
+        self.successor_dict = {}  # type: Dict[str, List[list]]
+        self.graph_successor_dict = {}  # type: Dict[str, List[str]]
+        for state in runtime.states:
+            successor_list = []
+            for action in state.actions:
+                to_state = runtime.get_state(action.to_state)
+                if to_state.name not in successor_list and to_state.type != StateTypeCode.NEED_IDENTIFY:
+                    successor_list.append(to_state.name)
+            self.graph_successor_dict[state.name] = successor_list
+        self.jump_state_list = [s.name for s in runtime.states if s.type == StateTypeCode.JUMP]
+
+    def record(self, from_state, to_state):
+        """
+        :param from_state: state of the previous classified screenshot
+        :param to_state: state of the current one. Screenshots of the same state are not a transition
+        """
+        if from_state == to_state:
+            return
+        successor_list = self.successor_dict.setdefault(from_state, [])
+        index = len(successor_list)
+        for i, item in enumerate(successor_list):
+            if item[0] == to_state:
+                item[1] += 1
+                index = i
+                break
+        else:
+            successor_list.append([to_state, 1])
+        # one step of insertion sort keeps the list ordered
+        while index > 0 and successor_list[index - 1][1] < successor_list[index][1]:
+            successor_list[index - 1], successor_list[index] = successor_list[index], successor_list[index - 1]
+            index -= 1
+
+    def get_candidate_list(self, curr_state=None, expected_state=None):
+        """
+        :param curr_state: state of the previous classified screenshot, None if unknown
+        :param expected_state: e.g. the to_state of the action just executed
+        :return: state names, may contain duplicates
+        """
+        candidate_list = [expected_state] if expected_state else []
+        if curr_state is not None:
+            candidate_list.extend(item[0] for item in self.successor_dict.get(curr_state, ()))
+        candidate_list.extend(self.jump_state_list)
+        if curr_state is not None:
+            candidate_list.append(curr_state)  # e.g. the action has not taken effect yet
+            candidate_list.extend(self.graph_successor_dict.get(curr_state, ()))
+        return candidate_list
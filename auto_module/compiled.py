@@ -0,0 +1,73 @@
+# encoding: utf-8
+
+import os
+from enum import IntEnum
+from typing import NamedTuple, Tuple, Dict
+
+from auto_module.condition import ConditionClause, ConditionExpression
+from auto_module.constant import STATE_TYPE, DIRECT_STATE_TYPE
+from auto_module.model import GameConfig, GameAction, GameState
+
+
+class StateTypeCode(IntEnum):
+    NORMAL = 0
+    JUMP = 1
+    HORIZONTAL_SWIPE = 2
+    VERTICAL_SWIPE = 3
+    NEED_IDENTIFY = 4
+
+
+STATE_TYPE_CODE = {STATE_TYPE[k]: StateTypeCode[k] for k in STATE_TYPE}
+
+
+class CompiledCondition(NamedTuple):
+    resource_dir: str
+    resource_name: str
+    not_flag: bool
+    clause: ConditionClause  # shares the observed fail rate with the GameState
+
+
+class CompiledState(NamedTuple):
+    name: str
+    type: StateTypeCode
+    is_direct: bool
+    conditions: Tuple[CompiledCondition, ...]
+    condition_expr: ConditionExpression
+    actions: Tuple[GameAction, ...]  # the actions leading to a state of the config
+    source: GameState
+
+
+class CompiledConfig:
+    __slots__ = ('game_config', 'states', 'state_dict')
+
+    def __init__(self, game_config: GameConfig):
+        """
+        Immutable runtime view of a GameConfig, read by the executor for the state types
+          and by the classifiers for the conditions and the successors.
+        State types are enum coded and conditions are resolved to resource paths once.
+        States are looked up by name like in the GameConfig, the executor and the route search work with names.
+        The editor keeps working on the mutable GameConfig, compile it again after editing
+        """
+        self.game_config = game_config
+        state_list = []
+        for state_name, state in game_config.game_state_dict.items():
+            state_list.append(CompiledState(
+                name=state_name,
+                type=STATE_TYPE_CODE[state.type],
+                is_direct=state.type in DIRECT_STATE_TYPE,
+                conditions=self.parse_conditions(state),
+                condition_expr=state.condition_expr,
+                actions=tuple(a for a in state.action_dict.values() if a.to_state in game_config.game_state_dict),
+                source=state,
+            ))
+        self.states = tuple(state_list)  # type: Tuple[CompiledState, ...]
+        self.state_dict = {state.name: state for state in state_list}  # type: Dict[str, CompiledState]
+
+    @staticmethod
+    def parse_conditions(game_state: GameState) -> Tuple[CompiledCondition, ...]:
+        resource_dir = os.path.join(game_state.game_config_dir, game_state.name)
+        return tuple(CompiledCondition(resource_dir, clause.template, clause.not_flag, clause)
+                     for clause in game_state.condition_expr.clause_list)
+
+    def get_state(self, state_name) -> CompiledState:
+        return self.state_dict[state_name]
@@ -0,0 +1,90 @@
+# encoding: utf-8
+
+from typing import List
+
+
+class ConditionClause:
+    def __init__(self, template, not_flag=False, threshold=None, region=None):
+        """
+        One condition image of a state
+
+        :param template: name of the condition image
+        :param not_flag: the image must NOT be in the screenshot
+        :param threshold: match threshold of this clause, MATCH_THRESHOLD if not presented (planned)
+        :param region: only search in (left, top, right, bottom) if presented (planned)
+        """
+        self.template = template
+        self.not_flag = not_flag
+        self.threshold = threshold
+        self.region = region
+        self.eval_count = 0
+        self.fail_count = 0  # times this clause decided the expression to be false
+
+    def to_str(self):
+        return '!' + self.template if self.not_flag else self.template
+
+    def get_fail_rate(self):
+        # Laplace smoothing, unseen clauses start at 0.5
+        return (self.fail_count + 1) / (self.eval_count + 2)
+
+    def __repr__(self) -> str:
+        return self.to_str()
+
+
+class ConditionExpression:
+    def __init__(self, clause_list: List[ConditionClause]):
+        """
+        Parsed conditions of a state: all the clauses must hold.
+        OR groups of the planned and/or support can be added as another level of expressions
+        """
+        self.clause_list = clause_list
+
+    @staticmethod
+    def parse(conditions: str):
+        """
+        :param conditions: condition string in config.json, e.g. '!a.png|b.png', '|' joins the clauses with AND
+        """
+        clause_list = []
+        if conditions:
+            for condition in conditions.split('|'):
+                if condition.startswith('!'):
+                    clause_list.append(ConditionClause(condition[1:], True))
+                else:
+                    clause_list.append(ConditionClause(condition))
+        return ConditionExpression(clause_list)
+
+    def to_str(self):
+        return '|'.join(clause.to_str() for clause in self.clause_list)
+
+    def is_empty(self):
+        return len(self.clause_list) == 0
+
+    def get_evaluation_order(self, cached_func=None) -> List[ConditionClause]:
+        """
+        Free clauses first, then the most selective ones, i.e. the ones which failed the most
+        :param cached_func: clause -> True if its result is known already
+        """
+        if cached_func is None:
+            return sorted(self.clause_list, key=lambda c: -c.get_fail_rate())
+        return sorted(self.clause_list, key=lambda c: (not cached_func(c), -c.get_fail_rate()))
+
+    def evaluate(self, match_func, cached_func=None):
+        """
+        Short-circuit evaluation in the order of get_evaluation_order
+        :param match_func: clause -> matched area of its template, or None
+        :param cached_func: clause -> True if match_func costs nothing for it
+        :return: whether the expression holds, and the matched areas of the clauses
+        """
+        if self.is_empty():
+            return False, []
+
+        rect_list = []
+        for clause in self.get_evaluation_order(cached_func):
+            clause.eval_count += 1
+            rect = match_func(clause)
+            if rect is not None:
+                rect_list.append(rect)
+            if clause.not_flag == (rect is not None):
+                clause.fail_count += 1
+                return False, []
+        return True, rect_list
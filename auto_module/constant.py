@@ -25,3 +25,10 @@ DIRECTION = {
     'RIGHT': 2,
     'DOWN': 3
 }
+
+
+# color of the captured frames
+CAPTURE_COLOR = {
+    'GRAY': 'gray',
+    'BGR': 'bgr',
+}
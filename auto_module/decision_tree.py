@@ -0,0 +1,255 @@
+# encoding: utf-8
+
+import argparse
+import math
+import os
+
+from auto_module.classifier import StateClassifier
+from auto_module.compiled import CompiledConfig
+from auto_module.image import get_gray_resource_img_key
+from auto_module.logger import get_logger
+from typing import FrozenSet, List, Tuple
+
+logger = get_logger('decision_tree')
+
+
+class DecisionNode:
+    __slots__ = ('key', 'present', 'absent', 'state_list')
+
+    def __init__(self, key=None, present=None, absent=None, state_list=()):
+        """
+        Internal nodes match the template key and go to present or absent,
+          leaves keep the states of the samples reaching them, the most frequent first
+        """
+        self.key = key
+        self.present = present  # type: DecisionNode
+        self.absent = absent  # type: DecisionNode
+        self.state_list = list(state_list)
+
+    def is_leaf(self):
+        return self.key is None
+
+
+def get_config_sample_list(classifier: StateClassifier) -> List[Tuple[str, FrozenSet[str]]]:
+    """
+    One sample screen per state, as the config describes it: the templates of the positive conditions
+      and of the actions of the state are present, and the other templates are absent
+    :return: [(state name, keys of the present templates), ...]. States without conditions never match and are skipped
+    """
+    sample_list = []
+    for state in classifier.runtime.states:
+        condition_list = classifier.state_condition_dict[state.name]
+        if len(condition_list) == 0:
+            continue
+        present_set = set(key for key, not_flag in condition_list if not not_flag)
+        for action in state.actions:
+            key = get_gray_resource_img_key(action.data_dir, action.condition)
+            if key in classifier.template_dict:
+                present_set.add(key)
+        sample_list.append((state.name, frozenset(present_set)))
+    return sample_list
+
+
+def get_frame_sample_list(classifier: StateClassifier, frame_list) -> List[Tuple[str, FrozenSet[str]]]:
+    """
+    :param frame_list: labelled screenshots, see auto_module.benchmark.load_labelled_frames
+    :return: [(state name or None, keys of the templates found in the screenshot), ...]
+    """
+    sample_list = []
+    for _, label, frame in frame_list:
+        hit_table = classifier.new_hit_table(None)
+        sample_list.append((label, frozenset(key for key in classifier.template_dict
+                                             if classifier.match_template(key, frame, hit_table) is not None)))
+    return sample_list
+
+
+def check_sample(condition_list, present_set):
+    return len(condition_list) > 0 and all((key in present_set) != not_flag for key, not_flag in condition_list)
+
+
+def find_ambiguous_state_pairs(classifier: StateClassifier, sample_list) -> List[Tuple[str, str]]:
+    """
+    :return: [(state, another state whose conditions are met by the screen of the state as well), ...].
+             Which one the classifier returns depends on the candidate order, so the executor may take one
+             for the other and classify the screen again and again
+    """
+    pair_list = []
+    for label, present_set in sample_list:
+        for state_name, condition_list in classifier.state_condition_dict.items():
+            if state_name != label and (label, state_name) not in pair_list \
+                    and check_sample(condition_list, present_set):
+                pair_list.append((label, state_name))
+    return pair_list
+
+
+def get_entropy(sample_list):
+    count_dict = {}
+    for label, _ in sample_list:
+        count_dict[label] = count_dict.get(label, 0) + 1
+    return -sum(n / len(sample_list) * math.log2(n / len(sample_list)) for n in count_dict.values())
+
+
+def build_decision_tree(sample_list, key_list) -> DecisionNode:
+    """
+    Greedy information gain tree over the templates, which tells the states of the samples apart
+      with as few template matches as possible on average
+    :param sample_list: [(state name or None, keys of the present templates), ...],
+                        the more samples of a state the shorter its path
+    :param key_list: template keys the tree can match
+    """
+    if len(sample_list) == 0 or get_entropy(sample_list) == 0:
+        return make_leaf(sample_list)
+
+    best = None
+    for key in key_list:
+        present_list = [s for s in sample_list if key in s[1]]
+        absent_list = [s for s in sample_list if key not in s[1]]
+        if len(present_list) == 0 or len(absent_list) == 0:
+            continue
+        score = len(present_list) * get_entropy(present_list) + len(absent_list) * get_entropy(absent_list)
+        if best is None or score < best[0]:
+            best = (score, key, present_list, absent_list)
+
+    if best is None:  # the remaining samples show the same templates
+        return make_leaf(sample_list)
+    _, key, present_list, absent_list = best
+    key_list = [k for k in key_list if k != key]
+    return DecisionNode(key, build_decision_tree(present_list, key_list), build_decision_tree(absent_list, key_list))
+
+
+def make_leaf(sample_list):
+    count_dict = {}
+    for label, _ in sample_list:
+        if label is not None:
+            count_dict[label] = count_dict.get(label, 0) + 1
+    return DecisionNode(state_list=sorted(count_dict.keys(), key=lambda s: -count_dict[s]))
+
+
+def format_tree(tree: DecisionNode, classifier: StateClassifier, indent=0):
+    prefix = '  ' * indent
+    if tree.is_leaf():
+        return prefix + '-> ' + (', '.join(tree.state_list) if tree.state_list else 'None')
+    resource_dir, resource_name = classifier.template_dict[tree.key]
+    name = os.path.basename(resource_dir) + '/' + resource_name
+    return '\n'.join([prefix + '[{0}] present:'.format(name), format_tree(tree.present, classifier, indent + 1),
+                      prefix + '[{0}] absent:'.format(name), format_tree(tree.absent, classifier, indent + 1)])
+
+
+class StateDecisionTree:
+    def __init__(self, classifier: StateClassifier, frame_sample_list=()):
+        """
+        Identify the state of a screenshot by walking a decision tree over the templates of the classifier,
+          then verifying the conditions of the states in the leaf.
+        If none of them is met the other states are checked as well, so the results are the ones of
+          StateClassifier.classify with the leaf states as candidates
+        :param frame_sample_list: samples of labelled screenshots, see get_frame_sample_list.
+                                  The states without any get the sample of get_config_sample_list
+        """
+        self.classifier = classifier
+        labelled_set = set(label for label, _ in frame_sample_list)
+        self.sample_list = list(frame_sample_list) + [s for s in get_config_sample_list(classifier)
+                                                      if s[0] not in labelled_set]
+        self.tree = build_decision_tree(self.sample_list, sorted(classifier.template_dict.keys()))
+        for a, b in find_ambiguous_state_pairs(classifier, self.sample_list):
+            logger.warning('The screen of state {0} meets the conditions of state {1} as well'.format(a, b))
+
+    def classify(self, src_img, candidate_list=(), changed_area_list=None, hit_table=None) -> Tuple[str, list]:
+        """
+        The same parameters and results as StateClassifier.classify.
+        The first candidate, e.g. the expected state, is checked before walking the tree,
+          and the states in the leaf are checked in the candidate order
+        """
+        classifier = self.classifier
+        hit_table = classifier.new_hit_table(changed_area_list, hit_table)
+        if len(candidate_list) > 0 and len(classifier.state_condition_dict.get(candidate_list[0], ())) > 0:
+            r = classifier.check_state(candidate_list[0], src_img, hit_table)
+            if r[0]:
+                return candidate_list[0], r[1]
+
+        node = self.tree
+        while not node.is_leaf():
+            node = node.present if classifier.match_template(node.key, src_img, hit_table) is not None else node.absent
+
+        state_list = node.state_list
+        if len(state_list) > 1 and len(candidate_list) > 0:
+            rank_dict = {}
+            for state_name in candidate_list:
+                rank_dict.setdefault(state_name, len(rank_dict))
+            state_list = sorted(state_list, key=lambda s: rank_dict.get(s, len(rank_dict)))
+        # most of the other states are ruled out by the templates on the path, which are in the hit table already
+        for state_name in classifier.get_ordered_state_list(state_list + list(candidate_list)):
+            r = classifier.check_state(state_name, src_img, hit_table)
+            if r[0]:
+                return state_name, r[1]
+        return None, []
+
+
+def count_scan_match(classifier: StateClassifier, present_set, state_list, matched_set=None):
+    """
+    :param matched_set: templates matched already, updated with the ones matched by the scan
+    :return: number of templates matched by checking the states of state_list one by one
+      on a screen where the templates of present_set are present
+    """
+    matched_set = matched_set if matched_set is not None else set()
+    matched_num = len(matched_set)
+    for state_name in state_list:
+        condition_list = classifier.state_condition_dict[state_name]
+        # the matched templates first, like ConditionExpression.evaluate with a cached_func
+        for key, not_flag in sorted(condition_list, key=lambda c: c[0] not in matched_set):
+            matched_set.add(key)
+            if (key in present_set) == not_flag:
+                break
+        else:
+            if len(condition_list) > 0:
+                break
+    return len(matched_set) - matched_num
+
+
+def count_tree_match(decision_tree: StateDecisionTree, present_set):
+    """
+    :return: number of templates matched by StateDecisionTree.classify without candidates
+    """
+    matched_set = set()
+    node = decision_tree.tree
+    while not node.is_leaf():
+        matched_set.add(node.key)
+        node = node.present if node.key in present_set else node.absent
+    state_list = decision_tree.classifier.get_ordered_state_list(node.state_list)
+    return len(matched_set) + count_scan_match(decision_tree.classifier, present_set, state_list, matched_set)
+
+
+if __name__ == '__main__':
+    from auto_module.benchmark import load_labelled_frames
+    from auto_module.model import read_game_config_file, GAME_CONFIG_FILENAME
+
+    parser = argparse.ArgumentParser(description='Build the state decision tree of a game config')
+    parser.add_argument('config_dir', help='dir containing config.json, e.g. game_tools/Arknights/1920x1080')
+    parser.add_argument('--frame-dir', help='labelled screenshots to build the tree from, see auto_module.benchmark')
+    args = parser.parse_args()
+
+    config = read_game_config_file(args.config_dir, GAME_CONFIG_FILENAME)
+    config.prepare()
+    state_classifier = StateClassifier(CompiledConfig(config))
+    frame_list = load_labelled_frames(args.frame_dir) if args.frame_dir else []
+    decision_tree = StateDecisionTree(state_classifier, get_frame_sample_list(state_classifier, frame_list))
+
+    print(format_tree(decision_tree.tree, state_classifier))
+    for pair in find_ambiguous_state_pairs(state_classifier, decision_tree.sample_list):
+        print('ambiguous: the screen of {0} meets the conditions of {1}'.format(*pair))
+    all_state_list = state_classifier.get_ordered_state_list(())
+    sample_num = len(decision_tree.sample_list)
+    print('samples: {0}, templates per sample: tree {1:.2f}, scan in config order {2:.2f}'.format(
+        sample_num, sum(count_tree_match(decision_tree, s[1]) for s in decision_tree.sample_list) / sample_num,
+        sum(count_scan_match(state_classifier, s[1], all_state_list) for s in decision_tree.sample_list) / sample_num))
+
+    if frame_list:
+        tree_num = scan_num = 0
+        for frame_path, label, frame in frame_list:
+            tree_result, _ = decision_tree.classify(frame)
+            tree_num += len(state_classifier.last_hit_table)
+            scan_result, _ = state_classifier.classify(frame)
+            scan_num += len(state_classifier.last_hit_table)
+            if tree_result != scan_result:
+                print('different: {0} is {1}, tree {2}, scan {3}'.format(frame_path, label, tree_result, scan_result))
+        print('frames: {0}, templates per frame: tree {1:.2f}, scan {2:.2f}'.format(
+            len(frame_list), tree_num / len(frame_list), scan_num / len(frame_list)))
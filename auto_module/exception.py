@@ -43,4 +43,12 @@ class CannotFindActionBySwipe(Exception):
         self.msg = info
 
     def __str__(self):
-        return self.msg
\ No newline at end of file
+        return self.msg
+
+
+class CaptureBackendException(Exception):
+    def __init__(self, info):
+        self.msg = info
+
+    def __str__(self):
+        return self.msg
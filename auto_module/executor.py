@@ -5,16 +5,26 @@ import cv2
 import numpy
 from PyQt5.QtCore import QObject, pyqtSignal
 
-from auto_module.constant import DIRECT_STATE_TYPE, RESERVED_STATE, STATE_TYPE, DIRECTION
+from auto_module.capture import CaptureBackend, GameWindowCapture, CaptureProducer
+from auto_module.constant import RESERVED_STATE, DIRECTION
+from auto_module.classifier import StateClassifier, TransitionModel
+from auto_module.compiled import CompiledConfig, CompiledState, StateTypeCode
 from auto_module.exception import CannotMoveForwardException, CannotFindActionBySwipe
-from auto_module.image import GameWindow, check_img_equal
-from auto_module.model import GameConfig, GameAction, GameState
+from auto_module.image import GameWindow, check_img_equal, ThreadPoolMatcher, FrameChangeDetector
+from auto_module.model import GameConfig, GameAction
+from auto_module.phash import PHashIndex, get_phash, get_index_signature
+from auto_module.profiler import profiler
+from auto_module.scheduler import AdaptiveWaiter
 from auto_module.logger import get_logger
 
 import random
 
 logger = get_logger('executor')
 SCT_INTERVAL = 1
+ACTION_TIMEOUT = 2  # seconds to wait for the screen to leave the state after an action before retrying it
+PARALLEL_MATCH_ENABLED = True  # match the condition templates on a thread pool instead of the RunThread
+CAPTURE_PRODUCER_ENABLED = True  # capture the game window on a background thread while matching
+PHASH_INDEX_ENABLED = True  # look up the screenshots seen before in a PHashIndex before matching templates
 
 
 class Executor(QObject):
@@ -25,11 +35,45 @@ class Executor(QObject):
     exception_happened = pyqtSignal(str)
     screenshot_status_sure = pyqtSignal(dict)
 
-    def __init__(self, game_config: GameConfig, game_window: GameWindow):
+    def __init__(self, game_config: GameConfig, game_window: GameWindow, capture_backend: CaptureBackend = None):
+        """
+        :param game_window: receives the clicks and swipes
+        :param capture_backend: source of the screenshots, GameWindowCapture of the game_window by default,
+                                grabbed by a CaptureProducer if CAPTURE_PRODUCER_ENABLED
+        """
         super().__init__()
         self.game_config = game_config
         self.game_window = game_window
-        self.status_hit_dict = {}
+        self.waiter = AdaptiveWaiter(max_interval=SCT_INTERVAL)
+        if capture_backend is None:
+            capture_backend = GameWindowCapture(game_window)
+            if CAPTURE_PRODUCER_ENABLED:
+                capture_backend = CaptureProducer(capture_backend, waiter=self.waiter)
+        self.capture_backend = capture_backend
+        self.matcher = ThreadPoolMatcher() if PARALLEL_MATCH_ENABLED else None
+        self.runtime = CompiledConfig(game_config)  # state types and conditions parsed once
+        self.state_classifier = StateClassifier(self.runtime, self.matcher)
+        self.transition_model = TransitionModel(self.runtime)
+        self.phash_index = PHashIndex(game_config.game_config_dir,
+                                      get_index_signature(self.state_classifier.state_condition_dict)) \
+            if PHASH_INDEX_ENABLED else None
+        self.last_judge_hash = None  # phash of the latest screenshot if the index answered its state
+        self.last_state = None  # the latest state classified, unlike last_judge_result it is never None
+        self.frame_change_detector = FrameChangeDetector()
+        self.last_judge_result = None
+        self.last_judge_valid = False
+        self.last_frame = None  # the latest screenshot
+        self.last_action_time = 0  # when the latest click was sent
+        # template key -> matched area in the latest screenshot, shared by the classification and the actions.
+        # Replaced on every capture, so a template is matched at most once per screenshot
+        self.hit_table = {}
+
+    def close(self):
+        self.capture_backend.close()
+        if self.phash_index is not None and self.phash_index.dirty:
+            self.phash_index.save()
+        if self.matcher is not None:
+            self.matcher.shutdown()
 
     def debug_judge_state(self):
         while True:
@@ -38,9 +82,19 @@ class Executor(QObject):
             logger.info('state from screenshot: {0}'.format(state_id))
             time.sleep(1)
 
-    def execute_to_loop(self, from_state: str, to_state: str, must_have_states=[]):
-        while True:
+    def execute_to_loop(self, from_state: str, to_state: str, must_have_states=[], loop_num=None):
+        """
+        :param loop_num: stop after this many loops, run forever if None
+        """
+        loop_index = 0
+        while loop_num is None or loop_index < loop_num:
+            loop_index += 1
             self.execute_to(from_state, to_state, must_have_states)
+            if self.game_config.action_stats.dirty:
+                self.game_config.action_stats.save()
+            if self.phash_index is not None and self.phash_index.dirty:
+                self.phash_index.save()
+            self.game_config.apply_action_stats()  # prefer the faster transitions in the next loop
 
     def execute_to(self, from_state: str, to_state: str, must_have_states=[]):
         """
@@ -51,10 +105,12 @@ class Executor(QObject):
         try:
             logger.info('In execute_to({0}, {1})'.format(from_state, to_state))
             state_id, _ = self.get_valid_state(from_state)
-            if self.game_config.game_state_dict[state_id].type not in DIRECT_STATE_TYPE and to_state != RESERVED_STATE['NEED_IDENTIFY']:
+            if not self.runtime.get_state(state_id).is_direct and to_state != RESERVED_STATE['NEED_IDENTIFY']:
                 state_id, _ = self.handle_abnormal_state(state_id)
 
-            action_list = self.game_config.get_shortest_action_list_with_predecessor(from_state, to_state, must_have_states)
+            with profiler.stage('path_lookup'):
+                action_list = self.game_config.get_shortest_action_list_with_predecessor(from_state, to_state,
+                                                                                         must_have_states)
             curr_state = from_state
             game_img = None
             action_index = 0
@@ -86,17 +142,19 @@ class Executor(QObject):
                     logger.info('move from {0} to {1}'.format(curr_state, action.to_state))
                     while state_id != action.to_state:
                         logger.info('Executing action {0}...'.format(action.name))
-                        self.execute_action(self.game_config.game_state_dict[curr_state], action)
-                        time.sleep(SCT_INTERVAL)
-                        state_id, game_img = self.get_valid_state(action.to_state)
+                        action_start_time = time.time()
+                        self.execute_action(self.runtime.get_state(curr_state), action)
+                        state_id, game_img = self.wait_for_action_result(curr_state, action.to_state,
+                                                                         self.last_action_time)
+                        self.record_action_result(action, curr_state, state_id, time.time() - action_start_time)
                         if state_id == action.to_state:
                             break
-                        if self.game_config.game_state_dict[state_id].type not in DIRECT_STATE_TYPE:
+                        if not self.runtime.get_state(state_id).is_direct:
                             state_id, game_img = self.handle_abnormal_state(state_id)
                         if state_id != action.to_state and to_state == RESERVED_STATE['NEED_IDENTIFY']:
                             break
                         if state_id != curr_state and state_id != action.to_state \
-                                and self.game_config.game_state_dict[state_id].type in DIRECT_STATE_TYPE:
+                                and self.runtime.get_state(state_id).is_direct:
                             self.execute_to(state_id, action.to_state)
 
                     logger.info('Action {0} finished'.format(action.name))
@@ -106,7 +164,7 @@ class Executor(QObject):
 
             while to_state != RESERVED_STATE['NEED_IDENTIFY'] and state_id != to_state:
                 logger.info('Trying to solve unmatched to_state {0}...'.format(state_id))
-                if self.game_config.game_state_dict[state_id].type not in DIRECT_STATE_TYPE:
+                if not self.runtime.get_state(state_id).is_direct:
                     state_id, game_img = self.handle_abnormal_state(state_id)
                 else:
                     raise CannotMoveForwardException('Cannot move from status {0}!!!'.format(state_id))
@@ -120,8 +178,9 @@ class Executor(QObject):
     def wait_until_screen_change(self, src_img):
         logger.info('Wait until screen change...')
         curr_img = self.get_screenshot()
+        self.waiter.reset()
         while check_img_equal(src_img, curr_img):
-            time.sleep(SCT_INTERVAL)
+            self.waiter.wait()
             curr_img = self.get_screenshot()
         logger.info('Wait until screen change finished')
 
@@ -129,95 +188,127 @@ class Executor(QObject):
         logger.info('Wait until current status is {0} or {1}'.format(game_state, prev_state))
         state_id, game_img = self.get_valid_state(game_state)
         while state_id not in [game_state, prev_state]:
-            if self.game_config.game_state_dict[state_id].type not in DIRECT_STATE_TYPE:
+            if not self.runtime.get_state(state_id).is_direct:
                 self.handle_abnormal_state(state_id)
-            time.sleep(SCT_INTERVAL)
+            self.waiter.wait()
             state_id, game_img = self.get_valid_state(game_state)
         logger.info('Wait finished at {0}'.format(state_id))
         return state_id, game_img
 
-    def get_valid_state(self, potential_status_name=None):
+    def get_valid_state(self, potential_status_name=None, newer_than=None):
         """
         Get a valid state from current screenshot.
         If current screenshot's status is invalid, it will loop
+        :param newer_than: timestamp, the first screenshot is captured after it
         """
-        game_img, state_id = self.get_screenshot_and_status(potential_status_name)
+        game_img, state_id = self.get_screenshot_and_status(potential_status_name, newer_than)
         logger.info('state from screenshot: {0}'.format(state_id))
         while state_id is None:
+            self.waiter.wait()
             game_img, state_id = self.get_screenshot_and_status(potential_status_name)
             logger.info('state from screenshot: {0}'.format(state_id))
-            time.sleep(SCT_INTERVAL)
         return state_id, game_img
 
+    def wait_for_action_result(self, from_state, to_state, action_time):
+        """
+        Poll fast after an action until the state is not from_state any more,
+          or ACTION_TIMEOUT passes so the caller can retry the action
+        :param action_time: timestamp of the action, the screenshots captured before it are never classified
+        """
+        deadline = time.time() + ACTION_TIMEOUT
+        self.waiter.reset()
+        while True:
+            self.waiter.wait()
+            state_id, game_img = self.get_valid_state(to_state, action_time)
+            if state_id != from_state or time.time() > deadline:
+                return state_id, game_img
+
+    def record_action_result(self, game_action, from_state, state_id, latency):
+        if game_action.to_state == RESERVED_STATE['NEED_IDENTIFY']:
+            success = state_id != from_state  # NEED_IDENTIFY has no conditions, any other state is the result
+        else:
+            success = state_id == game_action.to_state
+        self.game_config.action_stats.record(game_action, latency, success)
+
     def handle_abnormal_state(self, game_state):
         """
         handle the abnormal state
         JUMP: it will try execute from game state to NEED_IDENTIFY state
         NEED_IDENTIFY: it is impossible to get this status since this status has no condition !!!
         """
-        if self.game_config.game_state_dict[game_state].type == STATE_TYPE['JUMP']:
+        if self.runtime.get_state(game_state).type == StateTypeCode.JUMP:
             return self.execute_to(game_state, RESERVED_STATE['NEED_IDENTIFY'])
 
     def judge_state(self, game_img, potential_status_name=None):
-        result = None
-        rect_list = None
-        if potential_status_name:
-            r = self.game_config.game_state_dict[potential_status_name].check_if_conditions_met(game_img)
-            if r[0]:
-                result = potential_status_name
-                rect_list = r[1]
+        changed_area_list = self.frame_change_detector.update(game_img)
+        if len(changed_area_list) > 0:
+            self.waiter.reset()  # something is moving, keep polling fast
+        elif self.last_judge_valid and potential_status_name in (None, self.last_judge_result):
+            logger.debug('screen not changed, reuse state {0}'.format(self.last_judge_result))
+            if game_img is self.last_frame:
+                self.hit_table = self.state_classifier.last_hit_table  # matches of the same screen
+            return self.last_judge_result
+
+        hit_table = self.hit_table if game_img is self.last_frame else None
+        # the answer of the phash index is checked on the same hit table the classification goes on with
+        hit_table = self.state_classifier.new_hit_table(changed_area_list, hit_table)
+        frame_hash, result, rect_list = None, None, []
+        self.last_judge_hash = None
+        if self.phash_index is not None:
+            with profiler.stage('phash_lookup'):
+                frame_hash = get_phash(game_img)
+                result, rect_list = self.phash_index.lookup(
+                    frame_hash, lambda s: self.state_classifier.spot_check_state(s, game_img, hit_table))
+            if result is not None:
+                self.last_judge_hash = frame_hash
 
         if result is None:
-            sorted_list = sorted(self.status_hit_dict.items(), key=lambda x: x[1])
-            visited_set = set(potential_status_name)
-            for s, _ in sorted_list:
-                if s not in visited_set:
-                    r = self.game_config.game_state_dict[s].check_if_conditions_met(game_img)
-                    if r[0]:
-                        result = s
-                        rect_list = r[1]
-                        break
-                    visited_set.add(s)
-
-            for game_state_id, game_state in self.game_config.game_state_dict.items():
-                if game_state_id in visited_set:
-                    continue
-                visited_set.add(game_state_id)
-                r = game_state.check_if_conditions_met(game_img)
-                if r[0]:
-                    result = game_state_id
-                    rect_list = r[1]
-                    break
+            candidate_list = self.transition_model.get_candidate_list(self.last_state, potential_status_name)
+            with profiler.stage('state_resolution'):
+                result, rect_list = self.state_classifier.classify(game_img, candidate_list, changed_area_list,
+                                                                   hit_table)
+            if frame_hash is not None and result is not None:
+                self.phash_index.add(frame_hash, result)
+        self.last_judge_result = result
+        self.last_judge_valid = True
 
         if result is not None:
-            if result not in self.status_hit_dict:
-                self.status_hit_dict[result] = 0
-            self.status_hit_dict[result] += 1
+            if self.last_state is not None:
+                self.transition_model.record(self.last_state, result)
+            self.last_state = result
 
+            # draw on a copy, the screenshot is compared with the next one by the frame_change_detector
+            marked_img = game_img.copy()
             for rect in rect_list:
-                cv2.rectangle(game_img, (rect[0], rect[1]), (rect[2], rect[3]), (255, 0, 0), 2)
-            self.screenshot_status_sure.emit({'screenshot': game_img})
+                cv2.rectangle(marked_img, (rect[0], rect[1]), (rect[2], rect[3]), (255, 0, 0), 2)
+            self.screenshot_status_sure.emit({'screenshot': marked_img})
         return result
 
-    def execute_action(self, game_state: GameState, game_action: GameAction):
+    def execute_action(self, game_state: CompiledState, game_action: GameAction):
+        """
+        The action is looked for in the latest screenshot, which the state was just classified on
+        """
         self.action_executed.emit(game_action.name)
-        game_img = self.get_screenshot()
-        if game_state.type == STATE_TYPE['NORMAL'] or game_state.type == STATE_TYPE['JUMP']:
+        if self.last_frame is None:
+            self.get_screenshot()
+        if game_state.type == StateTypeCode.NORMAL or game_state.type == StateTypeCode.JUMP:
             self.execute_click_action(game_action)
-        elif game_state.type == STATE_TYPE['HORIZONTAL_SWIPE']:
-            curr_img = game_img
+        elif game_state.type == StateTypeCode.HORIZONTAL_SWIPE:
+            curr_img = self.last_frame
             prev_img = None
-            action_satisfied = game_action.check_if_condition_met(curr_img)
+            action_satisfied = game_action.check_if_condition_met(curr_img, self.hit_table)
             direction_list = [DIRECTION['RIGHT'], DIRECTION['LEFT']]
             for direction in direction_list:
                 logger.info('Trying to swipe to {0}'.format(direction))
                 while not action_satisfied:
                     prev_img = curr_img
-                    self.game_window.swipe(direction)
-                    time.sleep(0.5)
+                    with profiler.stage('swipe'):
+                        self.game_window.swipe(direction)
+                    with profiler.stage('wait'):
+                        time.sleep(0.5)
                     logger.info('swipe finished')
                     curr_img = self.get_screenshot()
-                    action_satisfied = game_action.check_if_condition_met(curr_img)
+                    action_satisfied = game_action.check_if_condition_met(curr_img, self.hit_table)
                     if check_img_equal(curr_img, prev_img):  # swipe to the end
                         break
             if not action_satisfied:
@@ -230,27 +321,45 @@ class Executor(QObject):
         return game_action.check_if_condition_met(curr_img)
 
     def execute_click_action(self, game_action: GameAction):
-        game_img = self.get_screenshot()
-        area = game_action.get_action_area(game_img)
+        """
+        Click the action area in the latest screenshot without capturing again
+        """
+        game_img = self.last_frame
+        area = game_action.get_action_area(game_img, self.hit_table)
         if not area:
             logger.warning('Failed to execute {0} due to miss match'.format(game_action.name))
+            if self.last_judge_hash is not None:  # the phash index may have answered a wrong state
+                self.phash_index.reject(self.last_judge_hash)
+                self.last_judge_valid = False
             return
         l, t, r, b = area
         logger.info('src_img shape: {0}'.format(game_img.shape))
         logger.info('action area: ({0}, {1}, {2}, {3})'.format(l, t, r, b))
         x = random.randint(l, r)
         y = random.randint(t, b)
-        self.game_window.click(x, y)
+        with profiler.stage('click'):
+            self.game_window.click(x, y)
+        self.last_action_time = time.time()
 
-    def get_screenshot_and_status(self, potential_status=None):
-        img = self.get_screenshot()
+    def get_screenshot_and_status(self, potential_status=None, newer_than=None):
+        img = self.get_screenshot(newer_than)
         status_id = self.judge_state(img, potential_status)
         self.game_state_changed.emit({
             'status': self.game_config.game_state_dict[status_id] if status_id is not None else None
         })
         return img, status_id
 
-    def get_screenshot(self):
-        img = self.game_window.game_screenshot()
-        self.screenshot_catched.emit({'screenshot': img})
+    def get_screenshot(self, newer_than=None):
+        """
+        :param newer_than: timestamp, wait for a screenshot captured after it if given
+        """
+        with profiler.stage('capture'):
+            if newer_than is None:
+                img, _ = self.capture_backend.grab()
+            else:
+                img, _ = self.capture_backend.grab_newer(newer_than, ACTION_TIMEOUT)
+        self.last_frame = img
+        self.hit_table = {}
+        # the gui keeps the frame while the capture goes on writing into its buffers, so it gets a copy
+        self.screenshot_catched.emit({'screenshot': img.copy()})
         return img
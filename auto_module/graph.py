@@ -0,0 +1,114 @@
+# encoding: utf-8
+
+import heapq
+import math
+
+
+class CompactGraph:
+    def __init__(self):
+        """
+        Directed graph on integer node ids with an outgoing-edge index.
+        Parallel edges are kept, each edge carries the object it stands for (e.g. the GameAction)
+        """
+        self.node_list = []  # node id -> node name
+        self.node_index = {}  # node name -> node id
+        self.out_edge_list = []  # node id -> [(to id, weight, predecessor id or -1, payload), ...]
+
+    def add_node(self, name) -> int:
+        if name not in self.node_index:
+            self.node_index[name] = len(self.node_list)
+            self.node_list.append(name)
+            self.out_edge_list.append([])
+        return self.node_index[name]
+
+    def add_edge(self, from_name, to_name, weight, payload, predecessor=None):
+        """
+        :param predecessor: the edge can only be walked when the previous node is predecessor, if presented
+        """
+        u = self.add_node(from_name)
+        v = self.add_node(to_name)
+        p = self.add_node(predecessor) if predecessor else -1
+        self.out_edge_list[u].append((v, weight, p, payload))
+
+    def shortest_path(self, source, target):
+        """
+        Dijkstra with a binary heap, predecessors of the edges are ignored
+        :return: payload list of the path, or None if no path found
+        """
+        if source not in self.node_index or target not in self.node_index:
+            return None
+        s = self.node_index[source]
+        t = self.node_index[target]
+        dis = [math.inf] * len(self.node_list)
+        parent_edge = [None] * len(self.node_list)  # node id -> (parent node id, payload)
+        dis[s] = 0
+        heap = [(0, s)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dis[u]:
+                continue
+            if u == t:
+                break
+            for v, weight, _, payload in self.out_edge_list[u]:
+                if d + weight < dis[v]:
+                    dis[v] = d + weight
+                    parent_edge[v] = (u, payload)
+                    heapq.heappush(heap, (dis[v], v))
+
+        if dis[t] == math.inf:
+            return None
+        payload_list = []
+        node = t
+        while node != s:
+            node, payload = parent_edge[node]
+            payload_list.append(payload)
+        payload_list.reverse()
+        return payload_list
+
+    def shortest_path_with_predecessor(self, source, target, must_have=()):
+        """
+        Uniform cost search on (node, previous node, visited must-have bitmask).
+        Each search state is expanded at most once and paths are rebuilt from parent pointers
+        :param source: source node name
+        :param target: target node name
+        :param must_have: node names the path must pass through
+        :return: payload list of the path, or None if no path found
+        """
+        if source not in self.node_index or target not in self.node_index:
+            return None
+        bit_dict = {}
+        for name in must_have:
+            if name not in self.node_index:
+                return None
+            node = self.node_index[name]
+            if node not in bit_dict:
+                bit_dict[node] = 1 << len(bit_dict)
+        full_mask = (1 << len(bit_dict)) - 1
+
+        s = self.node_index[source]
+        t = self.node_index[target]
+        parent_list = [(-1, None)]  # label id -> (parent label id, payload of the edge walked)
+        heap = [(0, 0, s, -1, bit_dict.get(s, 0))]  # cost, label id, node, previous node, mask
+        settled = set()
+        while heap:
+            cost, label, u, prev, mask = heapq.heappop(heap)
+            if (u, prev, mask) in settled:
+                continue
+            settled.add((u, prev, mask))
+            if u == t and mask == full_mask and label != 0:
+                payload_list = []
+                while label != 0:
+                    label, payload = parent_list[label][0], parent_list[label][1]
+                    payload_list.append(payload)
+                payload_list.reverse()
+                return payload_list
+
+            for v, weight, predecessor, payload in self.out_edge_list[u]:
+                if predecessor >= 0 and prev >= 0 and predecessor != prev:
+                    continue
+                next_mask = mask | bit_dict.get(v, 0)
+                if (v, u, next_mask) in settled:
+                    continue
+                parent_list.append((label, payload))
+                heapq.heappush(heap, (cost + weight, len(parent_list) - 1, v, u, next_mask))
+        return None
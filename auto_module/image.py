@@ -2,29 +2,53 @@
 
 import ctypes
 import datetime
+import hashlib
 import time
 
-import numpy
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import cv2
 import numpy as np
-import win32api
-import win32con
-import win32gui
-import win32ui
 from PyQt5.QtGui import QImage
 
-from mss import mss
+try:
+    import win32api
+    import win32con
+    import win32gui
+    import win32ui
+except ImportError:  # GameWindow only works on Windows, use the backends in auto_module.capture elsewhere
+    win32api = win32con = win32gui = win32ui = None
 
-from auto_module.constant import DIRECTION
+from auto_module.constant import DIRECTION, CAPTURE_COLOR
+from auto_module.exception import CaptureBackendException
 from auto_module.logger import get_logger
+from auto_module.profiler import profiler
 
 MATCH_THRESHOLD = 0.95
+ROI_MATCH_ENABLED = True  # search around the last matched position first
+ROI_PADDING = 40  # pixels added to each side of the last matched area when searching the roi
+PYRAMID_MATCH_ENABLED = True  # find candidates on downscaled images, then confirm them with the full resolution
+PYRAMID_SCALES = [4, 2]  # downscale factors, from the coarsest to the finest
+PYRAMID_CANDIDATE_THRESHOLD = 0.7  # downscaled images lose details, so a lower threshold is used for candidates
+PYRAMID_CANDIDATE_NUM = 3
+PYRAMID_MIN_TEMPLATE_SIZE = 16  # scales making the template smaller than this will be skipped
+# the template is absent if the coarsest scale correlates below MATCH_THRESHOLD - PYRAMID_MISS_MARGIN,
+#   the present templates correlate above 0.72 on the Arknights screenshots even when off the downscale grid
+PYRAMID_MISS_MARGIN = 0.3
+MATCH_WORKER_NUM = os.cpu_count() or 1  # default thread number of ThreadPoolMatcher
+SCREENSHOT_BUFFER_NUM = 3  # a screenshot stays valid until this many newer screenshots are taken
+FRAME_DIFF_SCALE = 4  # frames are downscaled by this factor before being compared
+FRAME_DIFF_TILE_GRID = (8, 8)  # columns, rows of the tiles reported by FrameChangeDetector
+FRAME_DIFF_THRESHOLD = 8  # a tile is changed if any downscaled pixel differs more than this
+RESOURCE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # least recently used templates are dropped above this size
+RESOURCE_CACHE_CHECK_INTERVAL = 1  # seconds between two mtime checks of the same cached image
 logger = get_logger('image')
 
 
-resource_img_dict = {}
+anchor_dict = {}  # (anchor key, screenshot shape) -> the area where the template matched last time
 
 
 def convert_bgr_to_QImage(t_img):
@@ -49,7 +73,7 @@ def convert_bgr_to_QImage(t_img):
 #     return x_list[0], y_list[0], x_list[-1], y_list[-1]
 
 
-def get_matched_area(src_image, target_image):
+def get_matched_area_full(src_image, target_image):
     """
     Get the position of the target_image in the src_image,
       and return the area of the target image based on the size of the target image
@@ -67,8 +91,188 @@ def get_matched_area(src_image, target_image):
         return None
 
 
-def check_contain_img(src_img, target_img):
-    r = get_matched_area(src_img, target_img)
+def find_match_candidates(result, candidate_num, threshold, suppress_w, suppress_h):
+    """
+    Find at most candidate_num peaks above threshold in the matchTemplate result.
+    The neighbourhood of each peak is suppressed so the candidates will not stick together
+    :return: [(x, y), ...]
+    """
+    candidates = []
+    for _ in range(candidate_num):
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        if max_val < threshold:
+            break
+        candidates.append(max_loc)
+        x, y = max_loc
+        result[max(0, y - suppress_h):y + suppress_h + 1, max(0, x - suppress_w):x + suppress_w + 1] = -1
+    return candidates
+
+
+def match_in_window(src_image, target_image, x, y, margin):
+    """
+    Match the target_image only around (x, y) with margin pixels
+    :return: max_val, (x, y) in the src_image. None if the window is out of the src_image
+    """
+    height, width = src_image.shape[0], src_image.shape[1]
+    left = max(0, x - margin)
+    top = max(0, y - margin)
+    right = min(width, x + target_image.shape[1] + margin)
+    bottom = min(height, y + target_image.shape[0] + margin)
+    if right - left < target_image.shape[1] or bottom - top < target_image.shape[0]:
+        return None
+    result = cv2.matchTemplate(src_image[top:bottom, left:right], target_image, cv2.TM_CCOEFF_NORMED)
+    min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+    return max_val, (max_loc[0] + left, max_loc[1] + top)
+
+
+def get_matched_area_pyramid(src_image, target_image, scales=None):
+    """
+    Coarse-to-fine matching. Candidates are found on the coarsest downscaled images,
+      then refined on each finer scale only in small windows around them,
+      and finally confirmed with the full resolution and MATCH_THRESHOLD.
+    The downscaled images may lose the true match, e.g. among repeated similar elements,
+      so the full resolution is searched when no candidate is confirmed but the coarsest scale peaked
+      within PYRAMID_MISS_MARGIN of MATCH_THRESHOLD. Below that the template is taken as absent
+      without any full resolution search
+    :param src_image: src image
+    :param target_image: template
+    :param scales: downscale factors from the coarsest to the finest, PYRAMID_SCALES by default
+    :return: left, top, right, bottom
+    """
+    if scales is None:
+        scales = PYRAMID_SCALES
+    h, w = target_image.shape[0], target_image.shape[1]
+    scales = [s for s in scales if h // s >= PYRAMID_MIN_TEMPLATE_SIZE and w // s >= PYRAMID_MIN_TEMPLATE_SIZE]
+    if len(scales) == 0:
+        return get_matched_area_full(src_image, target_image)
+
+    candidates = None
+    prev_scale = None
+    for scale in scales + [1]:
+        if scale == 1:
+            s_src, s_target = src_image, target_image
+        else:
+            s_src = cv2.resize(src_image, (src_image.shape[1] // scale, src_image.shape[0] // scale),
+                               interpolation=cv2.INTER_AREA)
+            s_target = cv2.resize(target_image, (w // scale, h // scale), interpolation=cv2.INTER_AREA)
+        threshold = MATCH_THRESHOLD if scale == 1 else PYRAMID_CANDIDATE_THRESHOLD
+
+        if candidates is None:
+            result = cv2.matchTemplate(s_src, s_target, cv2.TM_CCOEFF_NORMED)
+            coarse_peak = cv2.minMaxLoc(result)[1]
+            candidates = find_match_candidates(result, PYRAMID_CANDIDATE_NUM, threshold,
+                                               s_target.shape[1] // 2, s_target.shape[0] // 2)
+            candidates = [(1.0, loc) for loc in candidates]
+        else:
+            ratio = prev_scale // scale
+            refined = []
+            for _, (x, y) in candidates:
+                r = match_in_window(s_src, s_target, x * ratio, y * ratio, ratio + 2)
+                if r is not None and r[0] >= threshold:
+                    refined.append(r)
+            candidates = refined
+        if len(candidates) == 0:
+            break
+        prev_scale = scale
+
+    if len(candidates) > 0:
+        max_val, max_loc = max(candidates, key=lambda c: c[0])
+        if max_val > MATCH_THRESHOLD:
+            return max_loc[0], max_loc[1], w + max_loc[0], h + max_loc[1]
+    if coarse_peak < MATCH_THRESHOLD - PYRAMID_MISS_MARGIN:
+        return None
+    return get_matched_area_full(src_image, target_image)
+
+
+def get_matched_area_global(src_image, target_image):
+    """
+    Search the whole src_image with the pyramid engine if PYRAMID_MATCH_ENABLED
+    """
+    if PYRAMID_MATCH_ENABLED:
+        return get_matched_area_pyramid(src_image, target_image)
+    return get_matched_area_full(src_image, target_image)
+
+
+def get_matched_area_in_roi(src_image, target_image, area, padding=ROI_PADDING):
+    """
+    Only search the target_image in the area padded with padding pixels
+    :param area: left, top, right, bottom in the src_image
+    :return: left, top, right, bottom in the src_image, or None if not found in the roi
+    """
+    height, width = src_image.shape[0], src_image.shape[1]
+    left = max(0, area[0] - padding)
+    top = max(0, area[1] - padding)
+    right = min(width, area[2] + padding)
+    bottom = min(height, area[3] + padding)
+    if right - left < target_image.shape[1] or bottom - top < target_image.shape[0]:
+        return None
+
+    r = get_matched_area_full(src_image[top:bottom, left:right], target_image)
+    if r is None:
+        return None
+    return r[0] + left, r[1] + top, r[2] + left, r[3] + top
+
+
+def get_matched_area_in_region(src_image, target_image, region, profile_key=None):
+    """
+    Search the target_image only inside the region, with the same engine as the full frame search
+    :param region: left, top, right, bottom in the src_image
+    :param profile_key: key of the template in the profiler
+    :return: left, top, right, bottom in the src_image
+    """
+    start_time = time.perf_counter()
+    r = find_area_in_region(src_image, target_image, region)
+    profiler.record_match(profile_key, time.perf_counter() - start_time)
+    return r
+
+
+def find_area_in_region(src_image, target_image, region):
+    height, width = src_image.shape[0], src_image.shape[1]
+    left, top = max(0, region[0]), max(0, region[1])
+    right, bottom = min(width, region[2]), min(height, region[3])
+    if right - left < target_image.shape[1] or bottom - top < target_image.shape[0]:
+        return None
+
+    r = get_matched_area_global(src_image[top:bottom, left:right], target_image)
+    if r is None:
+        return None
+    return r[0] + left, r[1] + top, r[2] + left, r[3] + top
+
+
+def get_matched_area(src_image, target_image, anchor_key=None):
+    """
+    Get the position of the target_image in the src_image.
+    When anchor_key is given and ROI_MATCH_ENABLED is set, the area around the last matched position
+      of the same anchor_key is searched first, and the full frame is searched only on a miss
+    :param src_image: src image
+    :param target_image: template
+    :param anchor_key: key identifying the template, e.g. the path of the template image
+    :return: left, top, right, bottom
+    """
+    start_time = time.perf_counter()
+    r = find_area_with_anchor(src_image, target_image, anchor_key)
+    profiler.record_match(anchor_key, time.perf_counter() - start_time)
+    return r
+
+
+def find_area_with_anchor(src_image, target_image, anchor_key):
+    if anchor_key is None or not ROI_MATCH_ENABLED:
+        return get_matched_area_global(src_image, target_image)
+
+    # the same template may stay at different positions with different resolutions
+    key = (anchor_key, src_image.shape[:2])
+    r = None
+    if key in anchor_dict:
+        r = get_matched_area_in_roi(src_image, target_image, anchor_dict[key])
+    if r is None:
+        r = get_matched_area_global(src_image, target_image)
+    if r is not None:
+        anchor_dict[key] = r
+    return r
+
+
+def check_contain_img(src_img, target_img, anchor_key=None):
+    r = get_matched_area(src_img, target_img, anchor_key)
     return r is not None, r
 
 
@@ -81,19 +285,261 @@ def get_raw_resource_img_QImage(resource_dir_path, resource_name):
     return QImage(img_path)
 
 
+def read_gray_img(img_path):
+    logger.info('read image ' + img_path)
+    img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+
+
+class ResourceImageCache:
+    def __init__(self, max_bytes=RESOURCE_CACHE_MAX_BYTES, check_interval=RESOURCE_CACHE_CHECK_INTERVAL):
+        """
+        Gray resource images by path, shared by all the loaded configs.
+        Entries are dropped in LRU order above max_bytes, and reloaded when the file is modified.
+        Images are read from the template bundles added by add_bundle if they are not older than the PNG files
+        :param check_interval: the mtime of a file is checked at most once per check_interval seconds
+        """
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        # image path -> [gray image, content key or None, mtime, last mtime check time]
+        self.entry_dict = OrderedDict()
+        self.bundle_dict = {}  # absolute config dir -> TemplateBundle
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+
+    def get_entry(self, img_path):
+        now = time.time()
+        with self.lock:
+            entry = self.entry_dict.get(img_path)
+            if entry is not None and now - entry[3] > self.check_interval:
+                entry[3] = now
+                try:
+                    modified = os.path.getmtime(img_path) != entry[2]
+                except OSError:  # deleted or renamed, e.g. by the editor
+                    modified = True
+                if modified:
+                    logger.info('{0} modified, reload it'.format(img_path))
+                    self.remove(img_path)
+                    entry = None
+            if entry is not None:
+                self.entry_dict.move_to_end(img_path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        mtime = os.path.getmtime(img_path)
+        bundle = self.bundle_dict.get(os.path.dirname(os.path.dirname(os.path.abspath(img_path))))
+        packed = bundle.get(img_path, mtime) if bundle is not None else None
+        img, key = packed if packed is not None else (read_gray_img(img_path), None)
+        with self.lock:
+            if img_path in self.entry_dict:  # loaded by another thread meanwhile
+                return self.entry_dict[img_path]
+            entry = [img, key, mtime, now]
+            self.entry_dict[img_path] = entry
+            self.bytes += img.nbytes
+            while self.bytes > self.max_bytes and len(self.entry_dict) > 1:
+                self.remove(next(iter(self.entry_dict)))
+                self.evictions += 1
+        return entry
+
+    def add_bundle(self, bundle):
+        """
+        :param bundle: TemplateBundle of a config dir, replaces the previous one of the same dir
+        """
+        with self.lock:
+            self.bundle_dict[os.path.abspath(bundle.config_dir)] = bundle
+
+    def remove(self, img_path):
+        entry = self.entry_dict.pop(img_path, None)
+        if entry is not None:
+            self.bytes -= entry[0].nbytes
+
+    def get(self, img_path):
+        return self.get_entry(img_path)[0]
+
+    def get_key(self, img_path):
+        """
+        Images with the same content get the same key even if they are in different dirs
+        """
+        entry = self.get_entry(img_path)
+        if entry[1] is None:
+            img = entry[0]
+            entry[1] = '{0}x{1}:{2}'.format(img.shape[1], img.shape[0], hashlib.md5(img.tobytes()).hexdigest())
+        return entry[1]
+
+    def invalidate(self, img_path=None):
+        """
+        :param img_path: drop this image only, or everything if None
+        """
+        with self.lock:
+            if img_path is None:
+                self.entry_dict.clear()
+                self.bytes = 0
+            else:
+                self.remove(img_path)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'images': len(self.entry_dict),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+resource_img_cache = ResourceImageCache()
+
+
 def get_gray_resource_img(resource_dir_path, resource_name):
-    img_path = os.path.join(resource_dir_path, resource_name)
-    if img_path not in resource_img_dict:
-        logger.info('read image ' + img_path)
-        img = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), cv2.IMREAD_COLOR)
-        # img = cv2.imread(img_path, cv2.IMREAD_COLOR)
-        img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
-        resource_img_dict[img_path] = img
-    return resource_img_dict[img_path]
+    return resource_img_cache.get(os.path.join(resource_dir_path, resource_name))
+
+
+def get_gray_resource_img_key(resource_dir_path, resource_name):
+    """
+    Images with the same content get the same key even if they are in different dirs
+    """
+    return resource_img_cache.get_key(os.path.join(resource_dir_path, resource_name))
+
+
+class ThreadPoolMatcher:
+    def __init__(self, worker_num=None):
+        """
+        Run matching jobs on a thread pool. cv2.matchTemplate releases the GIL,
+          so the jobs of one screenshot are matched on several cores at the same time
+        :param worker_num: thread number, MATCH_WORKER_NUM by default
+        """
+        self.worker_num = worker_num if worker_num else MATCH_WORKER_NUM
+        self.pool = ThreadPoolExecutor(max_workers=self.worker_num)
+
+    def submit(self, src_img, target_img, anchor_key=None, region=None):
+        """
+        :return: a Future of get_matched_area(src_img, target_img, anchor_key),
+                 or get_matched_area_in_region(src_img, target_img, region) if region is given
+        """
+        if region is not None:
+            return self.pool.submit(get_matched_area_in_region, src_img, target_img, region, anchor_key)
+        return self.pool.submit(get_matched_area, src_img, target_img, anchor_key)
+
+    def submit_all(self, src_img, job_list):
+        """
+        :param src_img: gray screenshot
+        :param job_list: [(anchor key, template, region or None), ...], submitted in this order
+        :return: {Future: anchor key}, wait for them with concurrent.futures.as_completed
+        """
+        future_dict = {}
+        for anchor_key, target_img, region in job_list:
+            future_dict[self.submit(src_img, target_img, anchor_key, region)] = anchor_key
+        return future_dict
+
+    @staticmethod
+    def cancel_all(future_dict):
+        """
+        Cancel the jobs not started yet, the running ones finish on their own
+        """
+        for future in future_dict:
+            future.cancel()
+
+    def match_all(self, src_img, job_list):
+        """
+        Match all the jobs against src_img and yield the results as they complete.
+        Jobs not started yet are cancelled once the generator is closed
+        :return: generator of (anchor key, left/top/right/bottom or None)
+        """
+        future_dict = self.submit_all(src_img, job_list)
+        try:
+            for future in as_completed(future_dict):
+                yield future_dict[future], future.result()
+        finally:
+            self.cancel_all(future_dict)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+def check_area_intersect(area_1, area_2):
+    return area_1[0] < area_2[2] and area_2[0] < area_1[2] and area_1[1] < area_2[3] and area_2[1] < area_1[3]
+
+
+class FrameChangeDetector:
+    def __init__(self, scale=FRAME_DIFF_SCALE, tile_grid=FRAME_DIFF_TILE_GRID, threshold=FRAME_DIFF_THRESHOLD):
+        """
+        Cheap change detector comparing downscaled frames tile by tile
+        :param scale: downscale factor
+        :param tile_grid: columns, rows
+        :param threshold: max difference of the downscaled pixels in an unchanged tile
+        """
+        self.scale = scale
+        self.tile_grid = tile_grid
+        self.threshold = threshold
+        self.prev_small_img = None  # the reference frame, downscaled
+        self.prev_shape = None
+
+    def reset(self):
+        self.prev_small_img = None
+        self.prev_shape = None
+
+    def update(self, img):
+        """
+        Compare the img with the reference frame tile by tile.
+        Only the changed tiles of the img are taken into the reference, they are the ones matched again,
+          so the other tiles are still compared with the frame their matches come from and a slow drift adds up
+        :return: [(left, top, right, bottom), ...] areas of the changed tiles in the img.
+                 Empty if nothing changed, the whole img if there is no comparable reference frame
+        """
+        height, width = img.shape[0], img.shape[1]
+        small_img = cv2.resize(img, (max(1, width // self.scale), max(1, height // self.scale)),
+                               interpolation=cv2.INTER_AREA)
+        prev_small_img = self.prev_small_img
+        if prev_small_img is None or self.prev_shape != img.shape:
+            self.prev_small_img = small_img
+            self.prev_shape = img.shape
+            return [(0, 0, width, height)]
+
+        diff = cv2.absdiff(small_img, prev_small_img)
+        if len(diff.shape) == 3:
+            diff = diff.max(axis=2)
+        columns, rows = self.tile_grid
+        small_h, small_w = diff.shape
+        row_starts = [small_h * i // rows for i in range(rows)]
+        column_starts = [small_w * i // columns for i in range(columns)]
+        tile_max = np.maximum.reduceat(np.maximum.reduceat(diff, row_starts, axis=0), column_starts, axis=1)
+
+        changed_area_list = []
+        for r, c in zip(*np.nonzero(tile_max > self.threshold)):
+            changed_area_list.append((width * c // columns, height * r // rows,
+                                      width * (c + 1) // columns, height * (r + 1) // rows))
+            tile = (slice(small_h * r // rows, small_h * (r + 1) // rows),
+                    slice(small_w * c // columns, small_w * (c + 1) // columns))
+            prev_small_img[tile] = small_img[tile]
+        return changed_area_list
+
+
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [
+        ('biSize', ctypes.c_uint32),
+        ('biWidth', ctypes.c_int32),
+        ('biHeight', ctypes.c_int32),
+        ('biPlanes', ctypes.c_uint16),
+        ('biBitCount', ctypes.c_uint16),
+        ('biCompression', ctypes.c_uint32),
+        ('biSizeImage', ctypes.c_uint32),
+        ('biXPelsPerMeter', ctypes.c_int32),
+        ('biYPelsPerMeter', ctypes.c_int32),
+        ('biClrUsed', ctypes.c_uint32),
+        ('biClrImportant', ctypes.c_uint32),
+    ]
 
 
 class GameWindow:
     def __init__(self, game_title):
+        if win32gui is None:
+            raise CaptureBackendException('GameWindow needs pywin32, which is only available on Windows')
         ctypes.windll.user32.SetProcessDPIAware()
         self.game_title = game_title
         self.hwnd = win32gui.FindWindow(None, self.game_title)
@@ -101,20 +547,84 @@ class GameWindow:
         self.mfcDC = win32ui.CreateDCFromHandle(self.hwndDC)
         self.saveDC = self.mfcDC.CreateCompatibleDC()
 
-    def game_screenshot(self):
+        # capture buffers, only reallocated when the window size changes
+        self.buffer_shape = None
+        self.dib_bitmap = None
+        self.old_bitmap = None
+        self.bgra_buffer = None  # numpy view of the pixels of dib_bitmap, BitBlt writes into it directly
+        self.output_buffer_dict = {}  # color -> [output array, ...] used in turn
+        self.output_index = 0
+
+    def prepare_buffers(self, width, height):
+        """
+        Create a DIB section selected into saveDC and a numpy view of its pixels
+        """
+        if self.buffer_shape == (width, height):
+            return
+        self.release_buffers()
+
+        gdi32 = ctypes.windll.gdi32
+        gdi32.CreateDIBSection.restype = ctypes.c_void_p
+        gdi32.CreateDIBSection.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint,
+                                           ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, ctypes.c_uint32]
+        header = BITMAPINFOHEADER()
+        header.biSize = ctypes.sizeof(BITMAPINFOHEADER)
+        header.biWidth = width
+        header.biHeight = -height  # top-down rows, the same as numpy
+        header.biPlanes = 1
+        header.biBitCount = 32
+        header.biCompression = 0  # BI_RGB
+        bits = ctypes.c_void_p()
+        self.dib_bitmap = gdi32.CreateDIBSection(self.saveDC.GetSafeHdc(), ctypes.byref(header), 0,  # DIB_RGB_COLORS
+                                                 ctypes.byref(bits), None, 0)
+        if not self.dib_bitmap:
+            raise CaptureBackendException('CreateDIBSection failed with size {0}x{1}'.format(width, height))
+        self.old_bitmap = win32gui.SelectObject(self.saveDC.GetSafeHdc(), self.dib_bitmap)
+        pixels = (ctypes.c_uint8 * (width * height * 4)).from_address(bits.value)
+        self.bgra_buffer = np.ctypeslib.as_array(pixels).reshape((height, width, 4))
+        self.output_buffer_dict = {}
+        self.buffer_shape = (width, height)
+        logger.info('capture buffers allocated for {0}x{1}'.format(width, height))
+
+    def release_buffers(self):
+        if self.dib_bitmap is None:
+            return
+        win32gui.SelectObject(self.saveDC.GetSafeHdc(), self.old_bitmap)
+        win32gui.DeleteObject(self.dib_bitmap)
+        self.dib_bitmap = None
+        self.old_bitmap = None
+        self.bgra_buffer = None
+        self.output_buffer_dict = {}
+        self.buffer_shape = None
+
+    def next_output_buffer(self, color):
+        """
+        The frames are converted into SCREENSHOT_BUFFER_NUM arrays in turn,
+          so a returned frame stays valid until SCREENSHOT_BUFFER_NUM newer frames are taken
+        """
+        width, height = self.buffer_shape
+        if color not in self.output_buffer_dict:
+            shape = (height, width, 3) if color == CAPTURE_COLOR['BGR'] else (height, width)
+            self.output_buffer_dict[color] = [np.empty(shape, dtype=np.uint8) for _ in range(SCREENSHOT_BUFFER_NUM)]
+        self.output_index = (self.output_index + 1) % SCREENSHOT_BUFFER_NUM
+        return self.output_buffer_dict[color][self.output_index]
+
+    def game_screenshot(self, color=CAPTURE_COLOR['GRAY']):
+        """
+        :return: the frame in one of the buffers of next_output_buffer, or None if the window is minimized.
+                 It is overwritten by later screenshots, copy it to keep it or to hand it to another thread
+        """
         if not win32gui.IsIconic(self.hwnd):  # check whether the window is minize or not
             width, height = self.get_shape()
-            saveBitMap = win32ui.CreateBitmap()
-            saveBitMap.CreateCompatibleBitmap(self.mfcDC, width, height)
-            self.saveDC.SelectObject(saveBitMap)
+            self.prepare_buffers(width, height)
             self.saveDC.BitBlt((0, 0), (width, height), self.mfcDC, (0, 0), win32con.SRCCOPY)
-            signedIntsArray = saveBitMap.GetBitmapBits(True)
-            im_opencv = numpy.fromstring(signedIntsArray, dtype='uint8')
-            im_opencv.shape = (height, width, 4)
-            # logger.info('screenshot shape: {0}'.format(im_opencv.shape))
+            ctypes.windll.gdi32.GdiFlush()  # make sure BitBlt finished writing into bgra_buffer
 
-            win32gui.DeleteObject(saveBitMap.GetHandle())
-            return cv2.cvtColor(im_opencv, cv2.COLOR_BGRA2GRAY)
+            output = self.next_output_buffer(color)
+            with profiler.stage('gray_conversion'):
+                if color == CAPTURE_COLOR['BGR']:
+                    return cv2.cvtColor(self.bgra_buffer, cv2.COLOR_BGRA2BGR, dst=output)
+                return cv2.cvtColor(self.bgra_buffer, cv2.COLOR_BGRA2GRAY, dst=output)
 
     def click(self, x, y):
         logger.info('offset: ({0}, {1})'.format(x, y))
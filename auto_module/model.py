@@ -2,14 +2,18 @@
 
 import os
 import json
-import math
-import queue
+import threading
 import networkx as nx
 
+from auto_module.bundle import load_bundle
+from auto_module.condition import ConditionExpression
 from auto_module.constant import STATE_TYPE, RESERVED_STATE
 from auto_module.exception import DatabaseIllegalException, GameConfigIllegalException, NoPathFindException
-from auto_module.image import get_gray_resource_img, check_contain_img, get_matched_area, get_raw_resource_img_QImage
+from auto_module.graph import CompactGraph
+from auto_module.image import get_gray_resource_img, get_gray_resource_img_key, get_matched_area, \
+    get_raw_resource_img_QImage, resource_img_cache
 from auto_module.logger import get_logger
+from auto_module.telemetry import ActionStatsStore, ACTION_STATS_WEIGHT_TOLERANCE
 from typing import List, Dict, Tuple
 
 GAME_DATABASE_DIR = 'D:\Workspace\git\AutoGameTools\game_tools'
@@ -21,7 +25,9 @@ logger = get_logger('model')
 def load_game_databases():
     """
     Read all the game configure files in the $GAME_DATABASE_DIR
-    Each game has a separate dir, and a configure file named $GAME_CONFIG_FILENAME in the game dir
+    Each game has a separate dir, and a configure file named $GAME_CONFIG_FILENAME in the game dir.
+    Only the config files are parsed, images are loaded by GameConfig.prepare or GameConfig.prefetch
+      when a config is selected
     :return: game config dict
     """
     logger.info('loading database from ' + GAME_DATABASE_DIR + ' ...')
@@ -64,9 +70,7 @@ def read_game_config_file(config_dir, config_name):
     """
     try:
         with open(os.path.join(config_dir, config_name), 'r', encoding='utf-8') as f:
-            json_str = ''.join(f.readlines())
-            config_json = json.loads(json_str, encoding='utf-8')
-            print(config_json)
+            config_json = json.load(f)
             game_config = GameConfig(
                 game_name=config_json['name'],
                 game_config_dir=config_dir
@@ -76,11 +80,16 @@ def read_game_config_file(config_dir, config_name):
                                        state_json['type'])
                 for action_json in state_json['actions']:
                     p = action_json['predecessor'] if 'predecessor' in action_json else None
+                    cost = action_json['cost'] if 'cost' in action_json else None
+                    if cost is not None and cost < 0:
+                        raise GameConfigIllegalException('Negative cost of action ' + action_json['name'])
                     game_action = GameAction(action_json['name'], action_json['method'],
-                                             action_json['condition'], game_state.name, action_json['successor'], p)
+                                             action_json['condition'], game_state.name, action_json['successor'], p,
+                                             cost)
                     game_state.add_action(game_action)
                 game_config.add_state(game_state)
-            game_config.prepare()
+            game_config.build_graph()
+            game_config.apply_action_stats()
             # game_config.draw_graph()
             return game_config
     except Exception as e:
@@ -88,7 +97,7 @@ def read_game_config_file(config_dir, config_name):
 
 
 class GameAction:
-    def __init__(self, name, method, condition, from_state, to_state, predecessor=None):
+    def __init__(self, name, method, condition, from_state, to_state, predecessor=None, cost=None):
         """
 
         :param name: action name
@@ -97,6 +106,8 @@ class GameAction:
         :param to_state: next state name
         :param predecessor: action only be executed when the previous status is predecessor if presented
                             will be checked when finding the shortest path for execution
+        :param cost: unitless weight of the action when finding the shortest path, relative to the others.
+                     1 if not presented
         """
         self.name = name
         self.method = method
@@ -105,6 +116,8 @@ class GameAction:
         self.data_dir = ''
         self.predecessor = predecessor
         self.from_state = from_state
+        self.cost = cost
+        self.learned_cost = None  # from the execution telemetry, see GameConfig.apply_action_stats
         self.condition_img = None  # only used during editing
 
     @staticmethod
@@ -119,12 +132,22 @@ class GameAction:
         )
 
     def to_json(self):
-        return {
+        r = {
             'name': self.name,
             'method': 'click',
             'condition': self.condition,
             'successor': self.to_state
         }
+        if self.predecessor:
+            r['predecessor'] = self.predecessor
+        if self.cost is not None:
+            r['cost'] = self.cost
+        return r
+
+    def get_cost(self):
+        if self.learned_cost is not None:
+            return self.learned_cost
+        return self.cost if self.cost is not None else 1
 
     def __str__(self) -> str:
         return '{0}|{1}|{2}|{3}'.format(self.name, self.method, self.condition, self.to_state)
@@ -132,21 +155,31 @@ class GameAction:
     def __repr__(self) -> str:
         return self.__str__()
 
-    def get_action_area(self, src_img):
+    def get_action_area(self, src_img, hit_table=None):
+        """
+        :param hit_table: template key -> matched area in src_img, shared by all the matches of the same screenshot.
+                          The area is looked up and cached in it if given
+        """
+        if hit_table is not None:
+            key = get_gray_resource_img_key(self.data_dir, self.condition)
+            if key not in hit_table:
+                hit_table[key] = self.get_action_area(src_img)
+            return hit_table[key]
         c_img = get_gray_resource_img(self.data_dir, self.condition)
-        return get_matched_area(src_img, c_img)
+        return get_matched_area(src_img, c_img, os.path.join(self.data_dir, self.condition))
 
     def get_raw_condition_img(self):
         if self.condition_img is None:
             self.condition_img = get_raw_resource_img_QImage(self.data_dir, self.condition)
         return self.condition_img
 
-    def check_if_condition_met(self, src_img):
-        c_img = get_gray_resource_img(self.data_dir, self.condition)
-        return check_contain_img(src_img, c_img)[0]
+    def check_if_condition_met(self, src_img, hit_table=None):
+        return self.get_action_area(src_img, hit_table) is not None
 
     def prepare(self):
-        self.condition_img = self.get_raw_condition_img()
+        # warm the gray image cache only, QImages are loaded when the editor needs them
+        if self.condition:
+            get_gray_resource_img(self.data_dir, self.condition)
 
 
 class GameState:
@@ -158,13 +191,22 @@ class GameState:
                            and/or will be supported in the future
         """
         self.name = name
-        self.conditions = conditions
+        self.conditions = conditions  # parsed into self.condition_expr
         self.condition_imgs = {}
         self.action_dict = {}  # type: Dict[str, GameAction]
         self.game_config_dir = game_config_dir
         self.type = state_type
         self.modified = False
 
+    @property
+    def conditions(self):
+        return self._conditions
+
+    @conditions.setter
+    def conditions(self, conditions):
+        self._conditions = conditions
+        self.condition_expr = ConditionExpression.parse(conditions)
+
     def to_json(self):
         action_json_list = []
         for action in self.action_dict.values():
@@ -193,36 +235,21 @@ class GameState:
         return get_gray_resource_img(os.path.join(self.game_config_dir, self.name), condition)
 
     def prepare(self):
-        if len(self.conditions) == 0:
+        if self.condition_expr.is_empty():
             return
-        for condition in self.conditions.split('|'):
-            if condition.startswith('!'):
-                self.get_raw_condition_img(condition[1:])
-            else:
-                self.get_raw_condition_img(condition)
+        for clause in self.condition_expr.clause_list:
+            self.get_gray_condition_img(clause.template)
         for action in self.action_dict.values():
             action.prepare()
 
     def check_if_conditions_met(self, src_img) -> Tuple[bool, list]:
-        if len(self.conditions) == 0:
-            return False, []
-
-        condition_img_list = self.conditions.split('|')
-        rect_list = []
-        for condition in condition_img_list:
-            not_flag = False
-            if condition.startswith('!'):
-                condition_img = condition[1:]
-                not_flag = True
-            else:
-                condition_img = condition
-            c_img = self.get_gray_condition_img(condition_img)
-            if_contains, rect = check_contain_img(src_img, c_img)
-            if if_contains:
-                rect_list.append(rect)
-            if not_flag == if_contains:
-                return False, []
-        return True, rect_list
+        condition_dir = os.path.join(self.game_config_dir, self.name)
+
+        def _match(clause):
+            c_img = self.get_gray_condition_img(clause.template)
+            return get_matched_area(src_img, c_img, os.path.join(condition_dir, clause.template))
+
+        return self.condition_expr.evaluate(_match)
 
 
 class GameConfig:
@@ -232,6 +259,12 @@ class GameConfig:
         self.game_state_dict = {}  # type: Dict[str, GameState]
         self.game_action_dict = {}
         self.graph = nx.DiGraph()  # type: nx.DiGraph
+        self.compact_graph = CompactGraph()  # outgoing-edge index for the route search
+        self.route_dict = {}  # (source, target, must have tuple) -> action list, None if there is no path
+        self.action_stats = ActionStatsStore(game_config_dir)
+        self.prepared = False  # images of the states and actions are loaded
+        self.prepare_lock = threading.Lock()
+        self.prefetch_thread = None
 
     def to_json(self):
         state_json_list = []
@@ -255,16 +288,85 @@ class GameConfig:
             self.game_action_dict[k] = v
 
     def prepare(self):
-        for state in self.game_state_dict.values():
-            state.prepare()
-        self.build_graph()
+        """
+        Load the images of all the states and actions. Called when the config is selected for running or editing
+        """
+        with self.prepare_lock:
+            if self.prepared:
+                return
+            logger.info('preparing game ' + self.game_name)
+            bundle = load_bundle(self.game_config_dir)
+            if bundle is not None:
+                resource_img_cache.add_bundle(bundle)
+            for state in list(self.game_state_dict.values()):
+                state.prepare()
+            self.prepared = True
+
+    def prefetch(self):
+        """
+        Prepare the config in a background thread
+        """
+        if self.prepared or (self.prefetch_thread is not None and self.prefetch_thread.is_alive()):
+            return
+
+        def _prefetch():
+            try:
+                self.prepare()
+            except Exception as e:
+                logger.warning('Prefetching game {0} failed: {1}'.format(self.game_name, e))
+
+        self.prefetch_thread = threading.Thread(target=_prefetch, daemon=True)
+        self.prefetch_thread.start()
 
     def build_graph(self):
         for state_name, _ in self.game_state_dict.items():
             self.graph.add_node(state_name)
+            self.compact_graph.add_node(state_name)
         for state_name, state in self.game_state_dict.items():
             for action in state.action_dict.values():
-                self.graph.add_edge(state_name, action.to_state, action=action.name, weight=1)
+                if action.to_state is None:  # default action just added in the editor
+                    continue
+                self.graph.add_edge(state_name, action.to_state, action=action.name, weight=action.get_cost())
+                self.compact_graph.add_edge(state_name, action.to_state, action.get_cost(), action, action.predecessor)
+
+    def apply_action_stats(self):
+        """
+        Use the learned latency of the actions as the edge weights.
+        The latencies are in seconds, so they are scaled to add up to the declared costs of the same actions,
+          and the actions without statistics keep their declared cost.
+        The routes are only rebuilt when a weight moves by more than ACTION_STATS_WEIGHT_TOLERANCE
+        :return: whether the weights changed
+        """
+        action_list = [a for state in self.game_state_dict.values() for a in state.action_dict.values()]
+        weight_dict = {}
+        for action in action_list:
+            weight = self.action_stats.get_weight(action)
+            if weight is not None:
+                weight_dict[action] = weight
+        if len(weight_dict) == 0 or sum(weight_dict.values()) == 0:
+            return False
+
+        scale = sum(a.cost if a.cost is not None else 1 for a in weight_dict) / sum(weight_dict.values())
+        changed = False
+        for action, weight in weight_dict.items():
+            weight_dict[action] = weight * scale
+            if abs(weight_dict[action] - action.get_cost()) > ACTION_STATS_WEIGHT_TOLERANCE * action.get_cost():
+                changed = True
+        if not changed:
+            return False
+        for action, weight in weight_dict.items():
+            action.learned_cost = weight
+        self.invalidate_routes()
+        return True
+
+    def invalidate_routes(self):
+        """
+        Must be called after states or actions are edited, so the graph and the cached routes are rebuilt
+        """
+        self.route_dict.clear()
+        self.graph = nx.DiGraph()
+        self.compact_graph = CompactGraph()
+        self.build_graph()
 
     def get_shortest_action_list(self, source_state, target_state) -> List[GameAction]:
         """
@@ -282,126 +384,47 @@ class GameConfig:
 
     def get_shortest_action_list_dijkstra(self, source_state, target_state) -> List[GameAction]:
         """
-        abandon due to the lack of the predecessor
+        Weighted shortest path on the compact graph, the predecessor is ignored
         """
-        action_list = []
-        adj = {}
-        dis = {}
-        visited = [source_state]
-
-        # prepare the adj dict and the distance dict
-        for u, v, data in self.graph.edges.data():
-            if u not in adj:
-                adj[u] = {}
-            adj[u][v] = data['weight']
-            if u == source_state:
-                dis[v] = data['weight']
-        for node in self.graph.nodes:
-            if node not in dis:
-                dis[node] = math.inf
-            if node not in adj:
-                adj[node] = {}
-        dis.pop(source_state)
-
-        # run Dijkstra until the target_state is visited or loop ends
-        parents_node = {}
-        for _ in range(len(dis)):
-            sort_dis = sorted(dis.items(), key=lambda item: item[1])
-            for p, d in sort_dis:
-                if p not in visited:
-                    min_dis_point = p
-                    min_dis = d
-                    visited.append(p)
-                    break
-            # 更新相邻点的开销
-            for n in adj[min_dis_point].keys():
-                if n in visited:
-                    continue
-                update = min_dis + adj[min_dis_point][n]
-                if dis[n] > update:
-                    dis[n] = update
-                    parents_node[n] = min_dis_point
-                else:
-                    parents_node[n] = source_state
-            if target_state in visited:
-                break
-
-        if target_state not in visited or dis[target_state] == math.inf:
+        if source_state == target_state:
+            return []
+        action_list = self.compact_graph.shortest_path(source_state, target_state)
+        if action_list is None:
             raise NoPathFindException('From {0} to {1}'.format(source_state, target_state))
-        else:
-            curr_state = target_state
-            while curr_state in parents_node:
-                action_list.append(self.game_action_dict[
-                                       self.graph.get_edge_data(parents_node[curr_state], curr_state)['action']
-                                   ])
-                curr_state = parents_node[curr_state]
-            action_list.append(self.game_action_dict[
-                                   self.graph.get_edge_data(source_state, curr_state)['action']
-                               ])
-            action_list.reverse()
         logger.info('Path {0} -> {1}: {2}'.format(source_state, target_state, action_list))
         return action_list
 
     def get_shortest_action_list_with_predecessor(self, source_state, target_state, must_have_states=[]) -> List[
         GameAction]:
         """
-        We will use BFS to search the path with the consideration of the predecessor
+        Routes are searched once and cached in route_dict until invalidate_routes() is called
+        """
+        key = (source_state, target_state, tuple(must_have_states))
+        if key not in self.route_dict:
+            try:
+                self.route_dict[key] = self.search_shortest_action_list_with_predecessor(
+                    source_state, target_state, must_have_states)
+            except NoPathFindException:
+                self.route_dict[key] = None
+        if self.route_dict[key] is None:
+            raise NoPathFindException('From {0} to {1} with must_have {2}'
+                                      .format(source_state, target_state, must_have_states))
+        return list(self.route_dict[key])
+
+    def search_shortest_action_list_with_predecessor(self, source_state, target_state, must_have_states=[]) -> List[
+        GameAction]:
+        """
+        Search the path on the compact graph with the consideration of the predecessor.
+        Action costs are used as the weights, so the path takes the least time when the config declares them
         """
         if source_state == target_state:
             return []
 
-        class _route:
-            def __init__(self, cost, path, action_path):
-                self.cost = cost
-                self.path = path
-                self.action_path = action_path
-
-            def __lt__(self, other):
-                return self.cost < other.cost
-
-            def walk(self, weight, next_point, action_id):
-                if next_point in self.path:
-                    return None
-                t_path = self.path[:]
-                t_path.append(next_point)
-                t_action_path = self.action_path[:]
-                t_action_path.append(action_id)
-                return _route(self.cost + weight, t_path, t_action_path)
-
-            def last(self):
-                return self.path[-1]
-
-            def predecessor(self):
-                return self.path[-2] if len(self.path) >= 2 else None
-
-            def check_must_have(self, must_have_states):
-                for s in must_have_states:
-                    if s not in self.path:
-                        return False
-                return True
-
-        q = queue.PriorityQueue()
-        q.put(_route(0, [source_state], []))
-        result = None
-        while not q.empty() and not result:
-            r = q.get()
-            for u, v, d in self.graph.edges.data():
-                if u != r.last():
-                    continue
-                p = r.predecessor()
-                n = None
-                t_action = self.game_action_dict[d['action']]
-                if not t_action.predecessor or not p or t_action.predecessor == p:
-                    n = r.walk(1, v, t_action)
-                if n:
-                    q.put(n)
-                    if v == target_state and n.check_must_have(must_have_states):
-                        result = n
-        if not result:
+        result = self.compact_graph.shortest_path_with_predecessor(source_state, target_state, must_have_states)
+        if result is None:
             raise NoPathFindException('From {0} to {1} with must_have {2}'
                                       .format(source_state, target_state, must_have_states))
-        else:
-            return result.action_path
+        return result
 
     def get_d3_data(self):
         nodes = []
@@ -0,0 +1,216 @@
+# encoding: utf-8
+
+import hashlib
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from auto_module.logger import get_logger
+
+PHASH_INDEX_FILENAME = 'phash_index.json'
+PHASH_INDEX_VERSION = 1
+PHASH_DCT_SIZE = 32  # the frame is shrunk to this size before the DCT
+PHASH_SAMPLE_FACTOR = 4  # the frame is subsampled to about this many times PHASH_DCT_SIZE before shrinking
+PHASH_LOW_SIZE = 8  # the lowest PHASH_LOW_SIZE x PHASH_LOW_SIZE frequencies make the 64 bit hash
+PHASH_RADIUS = 4  # frames whose hashes differ in at most this many bits are taken as the same screen
+PHASH_MIN_CONFIRMATIONS = 2  # classifications agreeing on a hash before the index answers for it
+PHASH_VERIFY_INTERVAL = 20  # every this many hits of a hash it is classified again
+PHASH_SAVE_INTERVAL = 60  # seconds between two saves of the index
+
+logger = get_logger('phash')
+
+
+def get_phash(img):
+    """
+    DCT perceptual hash of a screenshot, stable under noise, scaling and slight color changes
+    :return: 64 bit int
+    """
+    if len(img.shape) == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    # every step-th pixel is enough for the low frequencies, and shrinking the full frame costs milliseconds
+    step = max(1, min(img.shape[0], img.shape[1]) // (PHASH_DCT_SIZE * PHASH_SAMPLE_FACTOR))
+    small = cv2.resize(img[::step, ::step], (PHASH_DCT_SIZE, PHASH_DCT_SIZE), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:PHASH_LOW_SIZE, :PHASH_LOW_SIZE].flatten()
+    bits = low > np.median(low[1:])  # the DC term only tells the brightness
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def get_hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def get_index_signature(state_condition_dict):
+    """
+    :param state_condition_dict: see StateClassifier.state_condition_dict
+    :return: digest of the states and their condition templates, the index is dropped when it changes
+    """
+    content = json.dumps(sorted((k, v) for k, v in state_condition_dict.items()), ensure_ascii=False)
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+class PHashIndex:
+    def __init__(self, config_dir, signature, radius=PHASH_RADIUS):
+        """
+        Perceptual hash of the classified screenshots -> state, persisted as $PHASH_INDEX_FILENAME
+          next to the config.json.
+        The hash is split into radius + 1 chunks, and two hashes within the radius share at least one chunk,
+          so only the hashes in the buckets of the chunks are compared.
+        Screens of different states within the radius of each other become conflicts, and the index never
+          answers near them
+
+        :param signature: see get_index_signature
+        """
+        self.path = os.path.join(config_dir, PHASH_INDEX_FILENAME)
+        self.signature = signature
+        self.radius = radius
+        bit_num = PHASH_LOW_SIZE * PHASH_LOW_SIZE
+        bound_list = [bit_num * i // (radius + 1) for i in range(radius + 2)]
+        self.chunk_list = [(bound_list[i], bound_list[i + 1] - bound_list[i]) for i in range(radius + 1)]
+        self.bucket_dict_list = [{} for _ in self.chunk_list]  # chunk value -> set of hashes, one dict per chunk
+        self.entry_dict = {}  # hash -> [state name, confirmations, hits since the last confirmation]
+        self.conflict_set = set()
+        self.stats = {'hits': 0, 'misses': 0, 'rejects': 0, 'conflicts': 0}
+        self.dirty = False
+        self.last_save_time = time.time()
+        self.load()
+
+    def get_chunk_list(self, h):
+        return [(h >> shift) & ((1 << size) - 1) for shift, size in self.chunk_list]
+
+    def insert(self, h):
+        for bucket_dict, chunk in zip(self.bucket_dict_list, self.get_chunk_list(h)):
+            bucket_dict.setdefault(chunk, set()).add(h)
+
+    def get_neighbor_list(self, h):
+        """
+        :return: [(distance, hash), ...] of the entries and conflicts within the radius
+        """
+        candidate_set = set()
+        for bucket_dict, chunk in zip(self.bucket_dict_list, self.get_chunk_list(h)):
+            candidate_set.update(bucket_dict.get(chunk, ()))
+        neighbor_list = []
+        for candidate in candidate_set:
+            distance = get_hamming_distance(h, candidate)
+            if distance <= self.radius:
+                neighbor_list.append((distance, candidate))
+        return neighbor_list
+
+    def lookup(self, h, check_func=None):
+        """
+        :param check_func: state name -> (whether the screenshot meets the conditions of the state, matched areas),
+                           e.g. StateClassifier.spot_check_state. A small button or a !template changes only
+                           a few bits of the hash, so the answer is checked before it is returned
+        :return: state name of the screenshot or None if it has to be classified, and the matched areas
+        """
+        best = None
+        state_set = set()
+        for distance, neighbor in self.get_neighbor_list(h):
+            if neighbor in self.conflict_set:
+                best = None
+                break
+            state_set.add(self.entry_dict[neighbor][0])
+            if best is None or distance < best[0]:
+                best = (distance, self.entry_dict[neighbor])
+        if best is None or len(state_set) > 1 or best[1][1] < PHASH_MIN_CONFIRMATIONS:
+            self.stats['misses'] += 1
+            return None, []
+
+        entry = best[1]
+        entry[2] += 1
+        if entry[2] >= PHASH_VERIFY_INTERVAL:  # confirmed again by add after the classification
+            entry[2] = 0
+            self.stats['misses'] += 1
+            return None, []
+        rect_list = []
+        if check_func is not None:
+            met, rect_list = check_func(entry[0])
+            if not met:
+                logger.info('phash {0:016x} is not state {1}'.format(h, entry[0]))
+                self.stats['rejects'] += 1
+                self.reject(h)
+                return None, []
+        self.stats['hits'] += 1
+        return entry[0], rect_list
+
+    def add(self, h, state_name):
+        """
+        Record the state a screenshot was classified as
+        """
+        conflict_list = [n for _, n in self.get_neighbor_list(h)
+                         if n not in self.conflict_set and self.entry_dict[n][0] != state_name]
+        if len(conflict_list) > 0:
+            for neighbor in conflict_list:
+                self.mark_conflict(neighbor)
+            self.mark_conflict(h)
+        elif h not in self.conflict_set:
+            if h in self.entry_dict:
+                self.entry_dict[h][1] += 1
+            else:
+                self.entry_dict[h] = [state_name, 1, 0]
+                self.insert(h)
+            self.dirty = True
+        if self.dirty and time.time() - self.last_save_time > PHASH_SAVE_INTERVAL:
+            self.save()
+
+    def reject(self, h):
+        """
+        The state the index answered for the screenshot turned out to be wrong, e.g. its action was not found
+        """
+        self.mark_conflict(h)
+        for _, neighbor in self.get_neighbor_list(h):
+            self.mark_conflict(neighbor)
+
+    def mark_conflict(self, h):
+        if h in self.conflict_set:
+            return
+        entry = self.entry_dict.pop(h, None)
+        logger.info('phash {0:016x} conflicts{1}'.format(h, ' with state ' + entry[0] if entry else ''))
+        self.conflict_set.add(h)
+        if entry is None:
+            self.insert(h)
+        self.stats['conflicts'] += 1
+        self.dirty = True
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['entries'] = len(self.entry_dict)
+        stats['conflict_hashes'] = len(self.conflict_set)
+        return stats
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                index_json = json.load(f)
+            if index_json['version'] != PHASH_INDEX_VERSION or index_json['signature'] != self.signature \
+                    or index_json['radius'] != self.radius:
+                logger.info('phash index {0} is out of date, dropped'.format(self.path))
+                return
+            for h, entry in index_json['entries'].items():
+                self.entry_dict[int(h, 16)] = [entry[0], entry[1], 0]
+            self.conflict_set = set(int(h, 16) for h in index_json['conflicts'])
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as e:
+            logger.warning('Failed to load phash index {0}: {1}'.format(self.path, e))
+            self.entry_dict.clear()
+            self.conflict_set.clear()
+        for h in self.entry_dict.keys() | self.conflict_set:
+            self.insert(h)
+
+    def save(self):
+        index_json = {
+            'version': PHASH_INDEX_VERSION,
+            'signature': self.signature,
+            'radius': self.radius,
+            'entries': {'{0:016x}'.format(h): [e[0], e[1]] for h, e in self.entry_dict.items()},
+            'conflicts': ['{0:016x}'.format(h) for h in self.conflict_set],
+        }
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index_json, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        self.last_save_time = time.time()
@@ -0,0 +1,168 @@
+# encoding: utf-8
+
+import bisect
+import os
+import threading
+import time
+
+from auto_module.logger import get_logger
+
+PROFILER_ENABLED = True
+PROFILER_SUMMARY_INTERVAL = 60  # seconds between two summaries in the log, never if None
+PROFILER_BUCKETS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]  # upper bounds in ms
+PROFILER_PERCENTILES = [50, 90, 99]
+
+logger = get_logger('profiler')
+
+
+class StageHistogram:
+    def __init__(self):
+        """
+        Durations of one stage in the buckets of PROFILER_BUCKETS, and one more bucket for the longer ones
+        """
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bucket_list = [0] * (len(PROFILER_BUCKETS) + 1)
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.bucket_list[bisect.bisect_left(PROFILER_BUCKETS, ms)] += 1
+
+    def percentile(self, p):
+        """
+        :return: upper bound of the bucket containing the p-th percentile in ms, capped by the max
+        """
+        if self.count == 0:
+            return None
+        rank = p / 100 * self.count
+        accumulated = 0
+        for index, n in enumerate(self.bucket_list):
+            accumulated += n
+            if accumulated >= rank and n > 0:
+                return min(PROFILER_BUCKETS[index], self.max) if index < len(PROFILER_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        r = {
+            'count': self.count,
+            'total_ms': self.total,
+            'mean_ms': self.total / self.count if self.count else None,
+            'min_ms': self.min,
+            'max_ms': self.max,
+        }
+        for p in PROFILER_PERCENTILES:
+            r['p{0}_ms'.format(p)] = self.percentile(p)
+        return r
+
+
+class StageTimer:
+    __slots__ = ('profiler', 'name', 'start_time')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.record(self.name, time.perf_counter() - self.start_time)
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class Profiler:
+    def __init__(self, enabled=PROFILER_ENABLED, summary_interval=PROFILER_SUMMARY_INTERVAL):
+        """
+        Duration histograms of the stages of the executor loop:
+          capture, gray_conversion, phash_lookup, match, match:<template>, state_resolution, path_lookup, click,
+          swipe, wait.
+        Stages can be nested, e.g. gray_conversion happens inside capture
+        """
+        self.enabled = enabled
+        self.summary_interval = summary_interval
+        self.histogram_dict = {}  # stage name -> StageHistogram
+        self.label_dict = {}  # template key -> readable name used in the match:<template> stages
+        self.lock = threading.Lock()
+        self.last_summary_time = time.time()
+        self.null_timer = NullTimer()
+
+    def stage(self, name):
+        """
+        with profiler.stage('capture'):
+            ...
+        """
+        return StageTimer(self, name) if self.enabled else self.null_timer
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            if name not in self.histogram_dict:
+                self.histogram_dict[name] = StageHistogram()
+            self.histogram_dict[name].add(seconds)
+            summary_due = self.summary_interval is not None \
+                and time.time() - self.last_summary_time > self.summary_interval
+            if summary_due:
+                self.last_summary_time = time.time()
+        if summary_due:
+            logger.info('stage summary:\n' + self.summary())
+
+    def record_match(self, key, seconds):
+        """
+        Record a template match in the match stage, and in the stage of the template if key is given
+        """
+        self.record('match', seconds)
+        if key is not None:
+            self.record(self.get_template_stage(key), seconds)
+
+    def set_label(self, key, label):
+        self.label_dict[key] = label
+
+    def get_template_stage(self, key):
+        """
+        :param key: template key, or the path of the template
+        """
+        label = self.label_dict.get(key)
+        if label is None:
+            parent, name = os.path.split(key)
+            label = os.path.basename(parent) + '/' + name if parent else name
+        return 'match:' + label
+
+    def get_stats(self, name=None):
+        """
+        :return: stats dict of the stage, or {stage name: stats dict} of all the stages if name is None
+        """
+        with self.lock:
+            if name is not None:
+                return self.histogram_dict[name].to_dict() if name in self.histogram_dict else None
+            return {k: v.to_dict() for k, v in self.histogram_dict.items()}
+
+    def reset(self):
+        with self.lock:
+            self.histogram_dict.clear()
+
+    def summary(self):
+        line_list = []
+        for name, stats in sorted(self.get_stats().items(), key=lambda x: -x[1]['total_ms']):
+            line_list.append('{0}: count {1}, total {2:.1f} ms, mean {3:.2f} ms, '.format(
+                name, stats['count'], stats['total_ms'], stats['mean_ms']) +
+                ', '.join('p{0} {1:.1f} ms'.format(p, stats['p{0}_ms'.format(p)]) for p in PROFILER_PERCENTILES))
+        return '\n'.join(line_list)
+
+
+profiler = Profiler()
@@ -0,0 +1,48 @@
+# encoding: utf-8
+
+import threading
+
+from auto_module.profiler import profiler
+
+WAIT_MIN_INTERVAL = 0.05  # seconds between two polls right after an action or a screen change
+WAIT_MAX_INTERVAL = 1  # seconds between two polls when the screen keeps static
+WAIT_BACKOFF_FACTOR = 2
+
+
+class AdaptiveWaiter:
+    def __init__(self, min_interval=WAIT_MIN_INTERVAL, max_interval=WAIT_MAX_INTERVAL,
+                 backoff_factor=WAIT_BACKOFF_FACTOR):
+        """
+        Replace the fixed sleep between two polls.
+        It polls fast after reset(), and backs off exponentially while nothing happens
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.interval = min_interval
+        self.wake_event = threading.Event()
+
+    def reset(self):
+        """
+        Poll fast again, e.g. right after an action or when the screen changed
+        """
+        self.interval = self.min_interval
+
+    def wake(self):
+        """
+        Stop the current wait() at once. Can be called from other threads
+        """
+        self.reset()
+        self.wake_event.set()
+
+    def wait(self):
+        """
+        Sleep for the current interval unless woken up, then back off
+        :return: True if woken up by wake()
+        """
+        with profiler.stage('wait'):
+            woken = self.wake_event.wait(self.interval)
+        self.wake_event.clear()
+        if not woken:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+        return woken
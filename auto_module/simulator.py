@@ -0,0 +1,229 @@
+# encoding: utf-8
+
+import argparse
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from auto_module.capture import CaptureBackend, CaptureProducer, convert_color
+from auto_module.constant import CAPTURE_COLOR, RESERVED_STATE, STATE_TYPE, DIRECT_STATE_TYPE
+from auto_module.image import get_gray_resource_img, get_matched_area_full, read_gray_img
+from auto_module.logger import get_logger
+from auto_module.model import GameConfig, read_game_config_file, GAME_CONFIG_FILENAME
+
+SIMULATOR_SHAPE = (1920, 1080)  # width, height of the rendered screenshots
+SIMULATOR_BACKGROUND = 30  # gray level of the rendered screenshots
+SIMULATOR_MARGIN = 40  # pixels between the rendered templates
+SIMULATOR_IMG_EXTENSIONS = ('.png', '.jpg', '.bmp')
+
+logger = get_logger('simulator')
+
+
+class SimulatedGame(CaptureBackend):
+    def __init__(self, game_config: GameConfig, start_state, latency=0.0, jump_probability=0.0,
+                 jump_state_list=None, frame_dir=None, identify_resolver=None, seed=None,
+                 color=CAPTURE_COLOR['GRAY']):
+        """
+        A fake game driven by the state machine of a GameConfig.
+        It is both the capture backend and the game window of an Executor, so the executor runs without Windows
+
+        :param start_state: the state shown at the beginning
+        :param latency: seconds between a click and the next state being shown, a blank screen is shown meanwhile
+        :param jump_probability: chance of showing a random jump state instead of the next state
+        :param jump_state_list: jump states to inject, the jump states which no action leads to by default
+        :param frame_dir: replay $frame_dir/<state name>/*.png (the first one) for the states having them,
+                          the other states are rendered by pasting their templates onto a blank screen
+        :param identify_resolver: (simulated game, from state) -> the state shown after an action to NEED_IDENTIFY.
+                                  By default the direct state before the latest direct state is shown again
+        """
+        super().__init__(color)
+        self.game_config = game_config
+        self.latency = latency
+        self.jump_probability = jump_probability
+        self.frame_dir = frame_dir
+        self.identify_resolver = identify_resolver if identify_resolver else SimulatedGame.resolve_identify
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        if jump_state_list is None:
+            to_state_set = set(a.to_state for s in game_config.game_state_dict.values() for a in s.action_dict.values())
+            jump_state_list = [s.name for s in game_config.game_state_dict.values()
+                               if s.type == STATE_TYPE['JUMP'] and s.name not in to_state_set]
+        self.jump_state_list = jump_state_list
+
+        self.frame_dict = {}  # state name -> screenshot
+        self.action_area_dict = {}  # state name -> [(action, area), ...]
+        self.blank_frame = np.full((SIMULATOR_SHAPE[1], SIMULATOR_SHAPE[0]), SIMULATOR_BACKGROUND, dtype=np.uint8)
+        self.blank_frame.setflags(write=False)
+
+        self.curr_state = None
+        self.next_state = None  # shown at self.transition_time
+        self.transition_time = 0
+        self.resume_state = None  # shown after the injected jump state
+        self.history = []  # direct states shown so far
+        self.stats = {'clicks': 0, 'missed_clicks': 0, 'swipes': 0, 'transitions': 0, 'injected_jumps': 0}
+        self.show_state(start_state)
+
+    @staticmethod
+    def resolve_identify(simulated_game, from_state):
+        if len(simulated_game.history) >= 2:
+            return simulated_game.history[-2]
+        return simulated_game.history[-1]
+
+    def get_frame(self, state_name):
+        if state_name not in self.frame_dict:
+            self.frame_dict[state_name], self.action_area_dict[state_name] = self.render(state_name)
+        return self.frame_dict[state_name]
+
+    def render(self, state_name):
+        """
+        :return: screenshot of the state, and where its actions are on it
+        """
+        game_state = self.game_config.game_state_dict[state_name]
+        state_dir = os.path.join(self.game_config.game_config_dir, state_name)
+        replay_dir = os.path.join(self.frame_dir, state_name) if self.frame_dir else None
+        if replay_dir and os.path.isdir(replay_dir):
+            frame_list = sorted(f for f in os.listdir(replay_dir) if f.lower().endswith(SIMULATOR_IMG_EXTENSIONS))
+            if len(frame_list) > 0:
+                frame = read_gray_img(os.path.join(replay_dir, frame_list[0]))
+                area_list = []
+                for action in game_state.action_dict.values():
+                    area = get_matched_area_full(frame, get_gray_resource_img(action.data_dir, action.condition))
+                    if area is not None:
+                        area_list.append((action, area))
+                frame.setflags(write=False)
+                return frame, area_list
+
+        # the templates which should be on the screen, the actions are pasted after the conditions
+        template_list = [c.template for c in game_state.condition_expr.clause_list if not c.not_flag]
+        action_template_dict = {}
+        for action in game_state.action_dict.values():
+            action_template_dict.setdefault(action.condition, []).append(action)
+            if action.condition not in template_list:
+                template_list.append(action.condition)
+
+        frame = self.blank_frame.copy()
+        area_list = []
+        x, y, row_height = SIMULATOR_MARGIN, SIMULATOR_MARGIN, 0
+        for template in template_list:
+            img = get_gray_resource_img(state_dir, template)
+            h, w = img.shape[0], img.shape[1]
+            if x + w + SIMULATOR_MARGIN > frame.shape[1]:
+                x, y, row_height = SIMULATOR_MARGIN, y + row_height + SIMULATOR_MARGIN, 0
+            if y + h + SIMULATOR_MARGIN > frame.shape[0]:
+                logger.warning('No room for {0} of state {1}'.format(template, state_name))
+                continue
+            frame[y:y + h, x:x + w] = img
+            for action in action_template_dict.get(template, []):
+                area_list.append((action, (x, y, x + w, y + h)))
+            x, row_height = x + w + SIMULATOR_MARGIN, max(row_height, h)
+        frame.setflags(write=False)
+        return frame, area_list
+
+    def show_state(self, state_name):
+        self.curr_state = state_name
+        self.next_state = None
+        if self.game_config.game_state_dict[state_name].type in DIRECT_STATE_TYPE:
+            self.history.append(state_name)
+        self.stats['transitions'] += 1
+        logger.info('simulated state: {0}'.format(state_name))
+
+    def update(self):
+        if self.next_state is not None and time.time() >= self.transition_time:
+            self.show_state(self.next_state)
+
+    def transit(self, action):
+        if action.to_state == RESERVED_STATE['NEED_IDENTIFY']:
+            if self.resume_state is not None:
+                to_state, self.resume_state = self.resume_state, None
+            else:
+                to_state = self.identify_resolver(self, self.curr_state)
+        else:
+            to_state = action.to_state
+
+        if self.resume_state is None and len(self.jump_state_list) > 0 \
+                and self.random.random() < self.jump_probability:
+            self.resume_state = to_state
+            to_state = self.random.choice(self.jump_state_list)
+            self.stats['injected_jumps'] += 1
+
+        self.next_state = to_state
+        self.transition_time = time.time() + self.latency
+        self.update()
+
+    def click(self, x, y):
+        with self.lock:
+            self.update()
+            self.stats['clicks'] += 1
+            if self.next_state is None:
+                self.get_frame(self.curr_state)
+                for action, (l, t, r, b) in self.action_area_dict[self.curr_state]:
+                    if l <= x <= r and t <= y <= b:
+                        logger.info('simulated click on {0}'.format(action.name))
+                        self.transit(action)
+                        return
+            self.stats['missed_clicks'] += 1
+
+    def swipe(self, direction):
+        # all the actions are rendered on the screen already
+        with self.lock:
+            self.stats['swipes'] += 1
+
+    def get_shape(self):
+        return SIMULATOR_SHAPE
+
+    def grab(self):
+        with self.lock:
+            self.update()
+            frame = self.blank_frame if self.next_state is not None else self.get_frame(self.curr_state)
+        return convert_color(frame, self.color), time.time()
+
+
+def run_simulation(game_config: GameConfig, from_state, to_state, must_have_states=(), loop_num=10, producer=False,
+                   **kwargs):
+    """
+    Run Executor.execute_to_loop on a SimulatedGame starting at from_state
+    :param producer: grab the simulated game with a CaptureProducer like the real game window
+    :param kwargs: passed to SimulatedGame
+    :return: report dict with the loops per hour
+    """
+    from auto_module.executor import Executor  # needs PyQt5
+
+    game_config.prepare()
+    simulated_game = SimulatedGame(game_config, from_state, **kwargs)
+    executor = Executor(game_config, simulated_game, simulated_game)
+    if producer:
+        executor.capture_backend = CaptureProducer(simulated_game, waiter=executor.waiter)
+    start_time = time.time()
+    try:
+        executor.execute_to_loop(from_state, to_state, list(must_have_states), loop_num)
+    finally:
+        executor.close()
+    seconds = time.time() - start_time
+    report = {'loops': loop_num, 'seconds': seconds, 'loops_per_hour': loop_num * 3600 / seconds if seconds else 0}
+    report.update(simulated_game.stats)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure execute_to_loop on a simulated game')
+    parser.add_argument('config_dir', help='dir containing config.json, e.g. game_tools/Arknights/1920x1080')
+    parser.add_argument('from_state')
+    parser.add_argument('to_state')
+    parser.add_argument('--must-have', nargs='*', default=[], help='states the route must pass')
+    parser.add_argument('--loops', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of each transition')
+    parser.add_argument('--jump-probability', type=float, default=0.0)
+    parser.add_argument('--frame-dir', help='screenshots to replay, one sub dir per state name')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--producer', action='store_true', help='grab the frames on a background thread')
+    args = parser.parse_args()
+
+    config = read_game_config_file(args.config_dir, GAME_CONFIG_FILENAME)
+    r = run_simulation(config, args.from_state, args.to_state, args.must_have, args.loops, args.producer,
+                       latency=args.latency, jump_probability=args.jump_probability, frame_dir=args.frame_dir,
+                       seed=args.seed)
+    print(', '.join('{0}: {1}'.format(k, round(v, 2) if isinstance(v, float) else v) for k, v in r.items()))
@@ -0,0 +1,84 @@
+# encoding: utf-8
+
+import json
+import os
+import time
+
+from auto_module.logger import get_logger
+
+ACTION_STATS_FILENAME = 'action_stats.json'
+ACTION_STATS_EWMA_ALPHA = 0.2  # weight of the newest sample
+ACTION_STATS_SAVE_INTERVAL = 60  # seconds between two saves of the store
+ACTION_STATS_MIN_SUCCESS_RATE = 0.05  # keeps the weight of always failing actions finite
+ACTION_STATS_WEIGHT_TOLERANCE = 0.1  # the routes are rebuilt when a learned weight moves by more than this ratio
+
+logger = get_logger('telemetry')
+
+
+class ActionStatsStore:
+    def __init__(self, config_dir):
+        """
+        Per-action latency and retry statistics of the executor,
+          persisted as $ACTION_STATS_FILENAME next to the config.json
+        """
+        self.path = os.path.join(config_dir, ACTION_STATS_FILENAME)
+        self.stats_dict = {}  # action key -> {'latency', 'success_rate', 'success', 'failure'}
+        self.dirty = False
+        self.last_save_time = time.time()
+        self.load()
+
+    @staticmethod
+    def get_action_key(game_action):
+        # action names are not unique across states
+        return '{0}|{1}'.format(game_action.from_state, game_action.name)
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.stats_dict = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Failed to load action stats {0}: {1}'.format(self.path, e))
+            self.stats_dict = {}
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.stats_dict, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        self.last_save_time = time.time()
+
+    def record(self, game_action, latency, success):
+        """
+        :param latency: seconds from executing the action to the confirmed result
+        :param success: whether the action reached its to_state, otherwise it will be retried
+        """
+        key = self.get_action_key(game_action)
+        alpha = ACTION_STATS_EWMA_ALPHA
+        if key not in self.stats_dict:
+            self.stats_dict[key] = {'latency': latency, 'success_rate': 1.0 if success else 0.0,
+                                    'success': 0, 'failure': 0}
+        stats = self.stats_dict[key]
+        if success:
+            stats['latency'] = alpha * latency + (1 - alpha) * stats['latency']
+            stats['success'] += 1
+        else:
+            stats['failure'] += 1
+        stats['success_rate'] = alpha * (1.0 if success else 0.0) + (1 - alpha) * stats['success_rate']
+
+        self.dirty = True
+        if time.time() - self.last_save_time > ACTION_STATS_SAVE_INTERVAL:
+            self.save()
+
+    def get_weight(self, game_action):
+        """
+        Expected seconds until the action succeeds, counting the retries
+        :return: None if the action has never succeeded
+        """
+        key = self.get_action_key(game_action)
+        if key not in self.stats_dict or self.stats_dict[key]['success'] == 0:
+            return None
+        stats = self.stats_dict[key]
+        return stats['latency'] / max(stats['success_rate'], ACTION_STATS_MIN_SUCCESS_RATE)
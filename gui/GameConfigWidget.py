@@ -9,6 +9,7 @@ from PyQt5.QtWebChannel import QWebChannel
 from PyQt5.QtWidgets import QWidget, QApplication, QMessageBox
 from PyQt5.QtWebEngineWidgets import QWebEngineView
 
+from auto_module.bundle import build_bundle
 from auto_module.model import load_game_databases, GameConfig, GameState, GameAction
 from gui.ActionEditWidget import ActionEditWidget
 from gui.StatusEditWidget import StatusEditWidget
@@ -58,12 +59,14 @@ class GameConfigWidget(QWidget, Ui_GameConfigWidget):
     def add_default_state(self):
         gs = GameState.default(self.current_config.game_config_dir)
         self.current_config.game_state_dict[gs.name] = gs
+        self.current_config.invalidate_routes()
         self.state_listWidget.insertItem(0, gs.name)
 
     def add_default_action(self):
         action = GameAction.default(self.state_listWidget.currentItem().text())
         self.current_config.game_state_dict[self.state_listWidget.currentItem().text()].action_dict[action.name] = action
         self.current_config.game_action_dict[action.name] = action
+        self.current_config.invalidate_routes()
         self.action_listWidget.insertItem(0, action.name)
 
     def show_status_edit_widget(self):
@@ -94,8 +97,10 @@ class GameConfigWidget(QWidget, Ui_GameConfigWidget):
             target_state.condition_imgs[condition['name'] + '.png'] = condition['img']
         target_state.conditions = condition_str[:-1]
         for action in target_state.action_dict.values():
+            action.get_raw_condition_img()  # read it from the old dir, the new one is created when saving
             action.from_state = target_state.name
             action.data_dir = os.path.join(target_state.game_config_dir, target_state.name)
+        self.current_config.invalidate_routes()
         self.state_listWidget.currentItem().setText(game_state_data['name'])
 
     def save_game_action(self, game_action_data):
@@ -115,6 +120,7 @@ class GameConfigWidget(QWidget, Ui_GameConfigWidget):
         target_action.condition = game_action_data['condition'] + '.png'
         target_action.to_state = game_action_data['to']
         target_action.condition_img = game_action_data['img']
+        self.current_config.invalidate_routes()
         self.action_listWidget.currentItem().setText(target_action.name)
 
     def init_game_selector(self):
@@ -154,6 +160,7 @@ class GameConfigWidget(QWidget, Ui_GameConfigWidget):
                                     .format(self.game_combobox.currentText(), self.resolution_combobox.currentText()),
                                     QMessageBox.Yes)
         self.current_config = self.game_config[self.game_combobox.currentText()][self.resolution_combobox.currentText()]
+        self.current_config.prefetch()
         self.set_config(self.current_config)
 
     def save_current_config(self):
@@ -162,22 +169,33 @@ class GameConfigWidget(QWidget, Ui_GameConfigWidget):
                 return
             game_config_dir = self.current_config.game_config_dir
             game_config_dir = '/var/test'
+            # QImages are loaded lazily, read all of them before the old files are removed
+            img_dict = {}  # state name -> {image name: QImage}
+            for state_name, state in self.current_config.game_state_dict.items():
+                for clause in state.condition_expr.clause_list:
+                    state.get_raw_condition_img(clause.template)
+                img_dict[state_name] = dict(state.condition_imgs)
+                for action in state.action_dict.values():
+                    img_dict[state_name][action.condition] = action.get_raw_condition_img()
+                for img_name, img in img_dict[state_name].items():
+                    if img is None or img.isNull():
+                        raise OSError('image {0} of state {1} cannot be read'.format(img_name, state_name))
+
             if os.path.exists(game_config_dir):
                 shutil.rmtree(game_config_dir)
             os.mkdir(game_config_dir)
-            for state_name, state in self.current_config.game_state_dict.items():
+            for state_name, state_img_dict in img_dict.items():
                 state_dir = os.path.join(game_config_dir, state_name)
                 if not os.path.exists(state_dir):
                     os.mkdir(state_dir)
-                for condition_img_name, condition_img in state.condition_imgs.items():
-                    condition_img.save(os.path.join(state_dir, condition_img_name), 'png')
-
-                for action_name, action in state.action_dict.items():
-                    action.condition_img.save(os.path.join(state_dir, action.condition), 'png')
+                for img_name, img in state_img_dict.items():
+                    if not img.save(os.path.join(state_dir, img_name), 'png'):
+                        raise OSError('failed to write ' + os.path.join(state_dir, img_name))
 
             # save config json file
             with open(os.path.join(game_config_dir, 'config.json'), 'w', encoding='utf-8') as f:
                 json.dump(self.current_config.to_json(), f, indent=4, ensure_ascii=False)
+            build_bundle(game_config_dir)
         except Exception as e:
             QMessageBox.critical(None, 'Error saving!', 'Cannot save game {0} with resolution {1}, {2}'
                                     .format(self.game_combobox.currentText(), self.resolution_combobox.currentText(), e),
@@ -44,6 +44,8 @@ class StatusWindow(QWidget, Ui_StatusWidget):
         self.setupUi(self)
 
         self.curr_pixmap = None
+        self.thread = None
+        self.game_executor = None
         self.game_config = load_game_databases()
 
         self.game_combobox.currentIndexChanged.connect(self.init_resolution_list)
@@ -108,8 +110,15 @@ class StatusWindow(QWidget, Ui_StatusWidget):
                                     )
             return
 
+        game_config = self.game_config[self.game_combobox.currentText()][self.resolution_combobox.currentText()]
+        try:
+            game_config.prepare()
+        except Exception as e:
+            QMessageBox.critical(self, 'Cannot Start', 'Loading images of {0} failed: {1}'
+                                 .format(game_config.game_name, e), QMessageBox.Ok)
+            return
         self.game_executor = Executor(
-            game_config=self.game_config[self.game_combobox.currentText()][self.resolution_combobox.currentText()],
+            game_config=game_config,
             game_window=self.game_window
         )
         self.game_executor.game_state_changed.connect(self.set_current_status)
@@ -139,6 +148,10 @@ class StatusWindow(QWidget, Ui_StatusWidget):
     def stop(self):
         if self.thread is not None and self.thread.isRunning():
             self.thread.terminate()
+            self.thread.wait()
+        if self.game_executor is not None:  # also when the run stopped by itself, e.g. on an exception
+            self.game_executor.close()
+            self.game_executor = None
         self.set_start_or_end_status(False)
 
     def init_game_list(self):
@@ -151,8 +164,11 @@ class StatusWindow(QWidget, Ui_StatusWidget):
         self.resolution_combobox.addItems(r)
 
     def init_status(self):
-        s_l = self.game_config[self.game_combobox.currentText()][
-            self.resolution_combobox.currentText()].game_state_dict.keys()
+        if self.resolution_combobox.currentText() not in self.game_config.get(self.game_combobox.currentText(), {}):
+            return
+        game_config = self.game_config[self.game_combobox.currentText()][self.resolution_combobox.currentText()]
+        game_config.prefetch()  # load the images while the user is choosing the states
+        s_l = game_config.game_state_dict.keys()
         self.from_combobox.clear()
         self.from_combobox.addItems(s_l)
 
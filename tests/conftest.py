@@ -0,0 +1,41 @@
+# encoding: utf-8
+
+import os
+
+import pytest
+
+from auto_module import image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCREENSHOT_DIR = os.path.join(REPO_DIR, 'game_tools', 'Arknights', 'test_o')  # real 1920x1080 screenshots
+CONFIG_DIR = os.path.join(REPO_DIR, 'game_tools', 'Arknights', '1920x1080')
+
+
+@pytest.fixture(autouse=True)
+def clear_anchor_dict():
+    # the anchors of one test must not shortcut the matching of the next one
+    image.anchor_dict.clear()
+    yield
+    image.anchor_dict.clear()
+
+
+@pytest.fixture
+def read_screenshot():
+    def _read(name):
+        return image.read_gray_img(os.path.join(SCREENSHOT_DIR, name))
+    return _read
+
+
+@pytest.fixture
+def read_template():
+    def _read(state_name, name):
+        return image.read_gray_img(os.path.join(CONFIG_DIR, state_name, name))
+    return _read
+
+
+@pytest.fixture
+def game_config():
+    from auto_module.model import read_game_config_file, GAME_CONFIG_FILENAME
+    config = read_game_config_file(CONFIG_DIR, GAME_CONFIG_FILENAME)
+    config.prepare()
+    return config
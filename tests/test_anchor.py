@@ -0,0 +1,51 @@
+# encoding: utf-8
+
+import numpy as np
+
+from auto_module import image
+from auto_module.image import get_matched_area, get_matched_area_in_roi
+
+
+def test_anchor_remembers_matched_area(read_screenshot, read_template):
+    screenshot = read_screenshot('行动配置.png')
+    template = read_template('行动配置', '快捷编队.png')
+    area = get_matched_area(screenshot, template, 'quick_team')
+    assert area == (1301, 29, 1597, 95)
+    assert image.anchor_dict[('quick_team', screenshot.shape[:2])] == area
+
+
+def test_anchor_hit_skips_full_frame(monkeypatch, read_screenshot, read_template):
+    screenshot = read_screenshot('行动配置.png')
+    template = read_template('行动配置', '快捷编队.png')
+    area = get_matched_area(screenshot, template, 'quick_team')
+
+    def _fail(src_image, target_image):
+        raise AssertionError('the full frame should not be searched')
+
+    monkeypatch.setattr(image, 'get_matched_area_global', _fail)
+    assert get_matched_area(screenshot, template, 'quick_team') == area
+
+
+def test_anchor_miss_falls_back_to_full_frame(read_screenshot, read_template):
+    screenshot = read_screenshot('行动配置.png')
+    template = read_template('行动配置', '快捷编队.png')
+    get_matched_area(screenshot, template, 'quick_team')
+
+    moved = np.roll(screenshot, 300, axis=0)  # the template moves out of the padded roi
+    area = get_matched_area(moved, template, 'quick_team')
+    assert area == (1301, 329, 1597, 395)
+    assert image.anchor_dict[('quick_team', moved.shape[:2])] == area
+
+
+def test_anchors_are_per_resolution(read_screenshot, read_template):
+    screenshot = read_screenshot('a1.png')  # 1920x1169 instead of 1920x1080
+    template = read_template('战术演习', 'LS-4.png')
+    get_matched_area(screenshot, template, 'ls_4')
+    assert list(image.anchor_dict.keys()) == [('ls_4', screenshot.shape[:2])]
+
+
+def test_roi_is_clipped_to_the_frame(read_screenshot, read_template):
+    screenshot = read_screenshot('行动配置.png')
+    template = read_template('行动配置', '返回.png')
+    assert get_matched_area_in_roi(screenshot, template, (41, 32, 198, 85)) == (41, 32, 198, 85)
+    assert get_matched_area_in_roi(screenshot, template, (1600, 900, 1757, 953)) is None
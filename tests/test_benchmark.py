@@ -0,0 +1,18 @@
+# encoding: utf-8
+
+from auto_module.benchmark import run_benchmark
+from auto_module.classifier import StateClassifier
+from auto_module.compiled import CompiledConfig
+
+
+def test_parallel_counts_the_submitted_jobs(game_config, read_screenshot):
+    frame_list = [('a2.png', '战术演习', read_screenshot('a2.png')),
+                  ('行动配置.png', '行动配置', read_screenshot('行动配置.png'))]
+    serial_report = run_benchmark(game_config, frame_list)
+    parallel_report = run_benchmark(game_config, frame_list, parallel=True)
+    assert serial_report['accuracy'] == parallel_report['accuracy'] == 1
+
+    # without candidates every template is submitted at once, including the ones cut off by the early break
+    template_num = len(StateClassifier(CompiledConfig(game_config)).template_dict)
+    assert parallel_report['templates_per_frame'] == {'mean': template_num, 'max': template_num}
+    assert serial_report['templates_per_frame']['max'] < template_num
@@ -0,0 +1,74 @@
+# encoding: utf-8
+
+import os
+import shutil
+
+import numpy as np
+
+from auto_module.bundle import build_bundle, load_bundle, BUNDLE_FILENAME
+from auto_module.image import read_gray_img, ResourceImageCache
+from tests.conftest import CONFIG_DIR
+
+
+def copy_states(tmp_path, state_list):
+    config_dir = str(tmp_path)
+    for state_name in state_list:
+        shutil.copytree(os.path.join(CONFIG_DIR, state_name), os.path.join(config_dir, state_name))
+    return config_dir
+
+
+def get_png_list(config_dir):
+    return [os.path.join(config_dir, d, name) for d in sorted(os.listdir(config_dir))
+            if os.path.isdir(os.path.join(config_dir, d))
+            for name in sorted(os.listdir(os.path.join(config_dir, d))) if name.endswith('.png')]
+
+
+def test_round_trip(tmp_path):
+    config_dir = copy_states(tmp_path, ['行动配置', 'LS-3选中'])
+    build_bundle(config_dir)
+    bundle = load_bundle(config_dir)
+    png_list = get_png_list(config_dir)
+    assert len(png_list) > 0 and sorted(bundle.info_dict.keys()) == sorted(png_list)
+    for img_path in png_list:
+        img, key = bundle.get(img_path, os.path.getmtime(img_path))
+        assert np.array_equal(img, read_gray_img(img_path))
+        assert key == ResourceImageCache().get_key(img_path)
+
+
+def test_newer_png_is_not_taken(tmp_path):
+    config_dir = copy_states(tmp_path, ['行动配置'])
+    build_bundle(config_dir)
+    img_path = get_png_list(config_dir)[0]
+    mtime = os.path.getmtime(img_path)
+    assert load_bundle(config_dir).get(img_path, mtime + 10) is None
+    assert load_bundle(config_dir).get(os.path.join(config_dir, '行动配置', 'missing.png'), mtime) is None
+
+
+def test_cache_reads_the_bundle(tmp_path):
+    config_dir = copy_states(tmp_path, ['行动配置'])
+    build_bundle(config_dir)
+    cache = ResourceImageCache()
+    cache.add_bundle(load_bundle(config_dir))
+    img_path = get_png_list(config_dir)[0]
+    img = cache.get(img_path)
+    assert isinstance(img, np.memmap)
+    assert np.array_equal(img, read_gray_img(img_path))
+
+
+def test_cache_finds_the_bundle_by_any_path(tmp_path, monkeypatch):
+    config_dir = copy_states(tmp_path / 'config', ['行动配置'])
+    build_bundle(config_dir)
+    cache = ResourceImageCache()
+    cache.add_bundle(load_bundle(config_dir + os.sep))
+    monkeypatch.chdir(str(tmp_path))
+    img_path = os.path.relpath(get_png_list(config_dir)[0])
+    assert not os.path.isabs(img_path)
+    assert isinstance(cache.get(img_path), np.memmap)
+
+
+def test_missing_or_broken_bundle(tmp_path):
+    config_dir = copy_states(tmp_path, ['行动配置'])
+    assert load_bundle(config_dir) is None
+    with open(os.path.join(config_dir, BUNDLE_FILENAME), 'wb') as f:
+        f.write(b'not a bundle')
+    assert load_bundle(config_dir) is None
@@ -0,0 +1,107 @@
+# encoding: utf-8
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from auto_module.capture import CaptureBackend, CaptureProducer
+from auto_module.exception import CaptureBackendException
+from auto_module.scheduler import AdaptiveWaiter
+
+
+class StubBackend(CaptureBackend):
+    def __init__(self, frame_func=None):
+        """
+        :param frame_func: grab number -> frame or None, a frame filled with the grab number by default
+        """
+        super().__init__()
+        self.frame_func = frame_func if frame_func else lambda i: np.full((90, 160), i % 256, dtype=np.uint8)
+        self.grab_num = 0
+        self.lock = threading.Lock()
+
+    def grab(self):
+        with self.lock:
+            self.grab_num += 1
+            n = self.grab_num
+        return self.frame_func(n), time.time()
+
+    def get_shape(self):
+        return 160, 90
+
+
+@pytest.fixture
+def make_producer():
+    producer_list = []
+
+    def _make(backend, **kwargs):
+        producer = CaptureProducer(backend, **kwargs)
+        producer_list.append(producer)
+        return producer
+    yield _make
+    for producer in producer_list:
+        producer.close()
+
+
+def test_frame_ids_increase(make_producer):
+    producer = make_producer(StubBackend(), fps=200)
+    _, first_id, first_ts = producer.latest(1)
+    time.sleep(0.05)
+    frame, frame_id, ts = producer.latest(1)
+    assert frame_id > first_id and ts > first_ts
+    assert frame[0, 0] == frame_id % 256  # the frame of the id, not of a later grab
+
+
+def test_output_buffers_are_reused(make_producer):
+    producer = make_producer(StubBackend(), fps=200, buffer_num=2)
+    a, _, _ = producer.latest(1)
+    b, _, _ = producer.latest(1)
+    c, _, _ = producer.latest(1)
+    assert a is c and a is not b
+    assert not np.shares_memory(a, producer.ring[0]) and not np.shares_memory(a, producer.ring[1])
+
+
+def test_wait_newer_returns_the_first_newer_frame(make_producer):
+    producer = make_producer(StubBackend(), fps=200)
+    _, frame_id, ts = producer.latest(1)
+    frame, newer_id, newer_ts = producer.wait_newer(ts, 1)
+    assert newer_ts > ts and newer_id > frame_id
+    assert frame[0, 0] == newer_id % 256
+
+
+def test_wait_newer_times_out(make_producer):
+    producer = make_producer(StubBackend(lambda i: None), fps=200)
+    with pytest.raises(CaptureBackendException):
+        producer.wait_newer(time.time(), 0.1)
+
+
+def test_grab_times_out_without_frames(make_producer):
+    producer = make_producer(StubBackend(lambda i: None), fps=200, timeout=0.1)  # e.g. the window is minimized
+    with pytest.raises(CaptureBackendException):
+        producer.grab()
+    with pytest.raises(CaptureBackendException):
+        producer.grab_newer(time.time(), 0.1)
+
+
+def test_backend_error_is_raised_to_the_consumer(make_producer):
+    def _fail(i):
+        raise OSError('window closed')
+
+    producer = make_producer(StubBackend(_fail), fps=200)
+    with pytest.raises(CaptureBackendException, match='window closed'):
+        producer.latest(1)
+    with pytest.raises(CaptureBackendException, match='window closed'):
+        producer.grab_newer(time.time(), 1)
+
+
+def test_backed_off_waiter_throttles_the_producer(make_producer):
+    waiter = AdaptiveWaiter(min_interval=0.5, max_interval=0.5)
+    backend = StubBackend(lambda i: np.zeros((90, 160), dtype=np.uint8))  # static screen
+    producer = make_producer(backend, fps=200, waiter=waiter)
+    time.sleep(0.3)
+    assert backend.grab_num == 1
+    # a consumer waiting for a new frame does not wait for the interval
+    _, _, ts = producer.latest(1)
+    producer.wait_newer(ts, 0.2)
+    assert backend.grab_num == 2
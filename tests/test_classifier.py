@@ -0,0 +1,109 @@
+# encoding: utf-8
+
+import os
+
+from auto_module import classifier as classifier_module
+from auto_module.classifier import StateClassifier, TransitionModel
+from auto_module.compiled import CompiledConfig
+from auto_module.image import get_gray_resource_img_key, ThreadPoolMatcher
+
+from tests.conftest import CONFIG_DIR
+
+
+def count_matches(monkeypatch):
+    count_dict = {}
+    get_matched_area = classifier_module.get_matched_area
+
+    def _count(src_img, target_img, anchor_key=None):
+        count_dict[anchor_key] = count_dict.get(anchor_key, 0) + 1
+        return get_matched_area(src_img, target_img, anchor_key)
+
+    monkeypatch.setattr(classifier_module, 'get_matched_area', _count)
+    return count_dict
+
+
+def test_templates_are_deduplicated_by_content(game_config):
+    assert get_gray_resource_img_key(os.path.join(CONFIG_DIR, '战术演习'), '开始行动.png') == \
+        get_gray_resource_img_key(os.path.join(CONFIG_DIR, '货物运送'), '开始行动.png')
+    state_classifier = StateClassifier(CompiledConfig(game_config))
+    condition_num = sum(len(c) for c in state_classifier.state_condition_dict.values())
+    assert len(state_classifier.template_dict) < condition_num
+
+
+def test_every_template_is_matched_once_per_screenshot(monkeypatch, game_config, read_screenshot):
+    state_classifier = StateClassifier(CompiledConfig(game_config))
+    count_dict = count_matches(monkeypatch)
+    for screenshot_name, state_name in [('a2.png', '战术演习'), ('行动配置.png', '行动配置')]:
+        count_dict.clear()
+        result, _ = state_classifier.classify(read_screenshot(screenshot_name))
+        assert result == state_name
+        assert max(count_dict.values()) == 1
+        assert set(count_dict.keys()) == set(state_classifier.last_hit_table.keys())
+
+
+def test_hit_table_is_reused_for_the_same_screenshot(monkeypatch, game_config, read_screenshot):
+    state_classifier = StateClassifier(CompiledConfig(game_config))
+    screenshot = read_screenshot('a2.png')
+    hit_table = {}
+    state_classifier.classify(screenshot, hit_table=hit_table)
+    count_dict = count_matches(monkeypatch)
+    assert state_classifier.classify(screenshot, hit_table=hit_table)[0] == '战术演习'
+    assert count_dict == {}
+
+
+def test_transition_model_order(game_config):
+    model = TransitionModel(CompiledConfig(game_config))
+    model.record('LS-3选中', '行动配置')
+    model.record('LS-3选中', 'LS-3选中')  # the same screen again is not a transition
+    assert model.successor_dict['LS-3选中'] == [['行动配置', 1]]
+
+    candidate_list = model.get_candidate_list('LS-3选中', '行动配置')
+    jump_num = len(model.jump_state_list)
+    assert jump_num > 0
+    assert candidate_list[:2] == ['行动配置', '行动配置']
+    assert candidate_list[2:2 + jump_num] == model.jump_state_list
+    assert candidate_list[2 + jump_num] == 'LS-3选中'
+    assert candidate_list[3 + jump_num:] == model.graph_successor_dict['LS-3选中']
+
+
+class RecordingMatcher(ThreadPoolMatcher):
+    def __init__(self):
+        super().__init__(worker_num=2)
+        self.submitted_list = []
+
+    def submit_all(self, src_img, job_list):
+        self.submitted_list.extend(key for key, _, _ in job_list)
+        return super().submit_all(src_img, job_list)
+
+
+def test_parallel_classify_matches_the_candidates_first(game_config, read_screenshot):
+    matcher = RecordingMatcher()
+    state_classifier = StateClassifier(CompiledConfig(game_config), matcher)
+    try:
+        assert state_classifier.classify(read_screenshot('a2.png'), ['战术演习'])[0] == '战术演习'
+        candidate_key_set = {key for key, _ in state_classifier.state_condition_dict['战术演习']}
+        assert set(matcher.submitted_list) == candidate_key_set
+
+        matcher.submitted_list.clear()
+        # the candidate is wrong, so the other states are matched as well
+        assert state_classifier.classify(read_screenshot('行动配置.png'), ['战术演习'])[0] == '行动配置'
+        assert len(matcher.submitted_list) > len(candidate_key_set)
+        assert len(set(matcher.submitted_list)) == len(matcher.submitted_list)
+    finally:
+        matcher.shutdown()
+
+
+def test_spot_check_matches_one_discriminating_template(game_config, read_screenshot):
+    state_classifier = StateClassifier(CompiledConfig(game_config))
+    start_key = get_gray_resource_img_key(os.path.join(CONFIG_DIR, '战术演习'), '开始行动.png')
+    assert state_classifier.state_discriminating_dict['战术演习'] == [(start_key, True)]
+
+    hit_table = state_classifier.new_hit_table(None)
+    assert state_classifier.spot_check_state('战术演习', read_screenshot('a2.png'), hit_table) == (True, [])
+    assert list(hit_table.keys()) == [start_key]
+    # a stage is selected on the same screen
+    screenshot = read_screenshot('a2.png')
+    start_img = state_classifier.get_template_img(start_key)
+    screenshot[900:900 + start_img.shape[0], 1500:1500 + start_img.shape[1]] = start_img
+    hit_table = state_classifier.new_hit_table(None)
+    assert state_classifier.spot_check_state('战术演习', screenshot, hit_table) == (False, [])
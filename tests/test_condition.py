@@ -0,0 +1,61 @@
+# encoding: utf-8
+
+from auto_module.condition import ConditionExpression
+
+
+def make_match_func(present_dict, called_list):
+    """
+    :param present_dict: template -> matched area, the other templates are absent
+    :param called_list: records the templates in the order they are matched
+    """
+    def _match(clause):
+        called_list.append(clause.template)
+        return present_dict.get(clause.template)
+    return _match
+
+
+def test_parse():
+    expr = ConditionExpression.parse('行动结束.png|!开始行动.png')
+    assert [(c.template, c.not_flag) for c in expr.clause_list] == [('行动结束.png', False), ('开始行动.png', True)]
+    assert expr.to_str() == '行动结束.png|!开始行动.png'
+    assert ConditionExpression.parse('').is_empty()
+    assert ConditionExpression.parse(None).is_empty()
+
+
+def test_evaluate():
+    expr = ConditionExpression.parse('a.png|!b.png')
+    assert expr.evaluate(make_match_func({'a.png': (0, 0, 10, 10)}, [])) == (True, [(0, 0, 10, 10)])
+    assert expr.evaluate(make_match_func({'a.png': (0, 0, 10, 10), 'b.png': (5, 5, 8, 8)}, []))[0] is False
+    assert expr.evaluate(make_match_func({}, [])) == (False, [])
+
+
+def test_empty_expression_never_holds():
+    called_list = []
+    assert ConditionExpression.parse('').evaluate(make_match_func({}, called_list)) == (False, [])
+    assert called_list == []
+
+
+def test_short_circuit():
+    expr = ConditionExpression.parse('a.png|b.png|c.png')
+    called_list = []
+    assert expr.evaluate(make_match_func({}, called_list))[0] is False
+    assert called_list == ['a.png']
+    assert expr.clause_list[0].fail_count == 1
+    assert [c.eval_count for c in expr.clause_list] == [1, 0, 0]
+
+
+def test_failing_clause_goes_first():
+    expr = ConditionExpression.parse('a.png|b.png')
+    expr.evaluate(make_match_func({'a.png': (0, 0, 1, 1)}, []))  # b.png decides the expression to be false
+    called_list = []
+    expr.evaluate(make_match_func({}, called_list))
+    assert called_list == ['b.png']
+
+
+def test_cached_clause_goes_first():
+    expr = ConditionExpression.parse('a.png|b.png')
+    expr.clause_list[0].fail_count = 5
+    expr.clause_list[0].eval_count = 5
+    called_list = []
+    expr.evaluate(make_match_func({'b.png': (0, 0, 1, 1)}, called_list), lambda c: c.template == 'b.png')
+    assert called_list == ['b.png', 'a.png']
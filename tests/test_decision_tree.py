@@ -0,0 +1,57 @@
+# encoding: utf-8
+
+import pytest
+
+from auto_module.classifier import StateClassifier
+from auto_module.compiled import CompiledConfig
+from auto_module.decision_tree import StateDecisionTree, build_decision_tree, find_ambiguous_state_pairs, \
+    get_config_sample_list
+from auto_module.simulator import SimulatedGame
+
+
+def get_leaf(tree, present_set):
+    node = tree
+    while not node.is_leaf():
+        node = node.present if node.key in present_set else node.absent
+    return node
+
+
+def test_tree_separates_the_samples():
+    sample_list = [('A', frozenset(['a', 'x'])), ('B', frozenset(['b', 'x'])), ('C', frozenset(['x'])),
+                   ('A', frozenset(['a']))]
+    tree = build_decision_tree(sample_list, ['a', 'b', 'x'])
+    for label, present_set in sample_list:
+        assert get_leaf(tree, present_set).state_list == [label]
+    assert tree.key == 'a'  # splits the most frequent state off first
+
+
+def test_leaf_keeps_indistinguishable_states_by_frequency():
+    sample_list = [('A', frozenset(['a'])), ('B', frozenset(['a'])), ('B', frozenset(['a'])), (None, frozenset())]
+    tree = build_decision_tree(sample_list, ['a'])
+    assert get_leaf(tree, {'a'}).state_list == ['B', 'A']
+    assert get_leaf(tree, set()).state_list == []
+
+
+@pytest.fixture
+def state_classifier(game_config):
+    return StateClassifier(CompiledConfig(game_config))
+
+
+def test_config_samples(state_classifier):
+    sample_dict = dict(get_config_sample_list(state_classifier))
+    assert '_NEED_IDENTIFY' not in sample_dict  # no condition, never matched
+    assert set(k for k, not_flag in state_classifier.state_condition_dict['行动配置'] if not not_flag) \
+        <= sample_dict['行动配置']
+    pair_list = find_ambiguous_state_pairs(state_classifier, get_config_sample_list(state_classifier))
+    assert ('LS-3行动结束', '行动结束') in pair_list
+
+
+def test_tree_classifies_like_the_classifier(game_config, state_classifier, read_screenshot):
+    decision_tree = StateDecisionTree(state_classifier)
+    simulated_game = SimulatedGame(game_config, '行动配置')
+    frame_list = [read_screenshot('行动配置.png'), read_screenshot('a2.png')]
+    frame_list += [simulated_game.get_frame(s.name) for s in state_classifier.runtime.states if s.conditions]
+    for frame in frame_list:
+        for candidate_list in ((), ('LS-3选中',)):
+            expected = state_classifier.classify(frame, candidate_list)
+            assert decision_tree.classify(frame, candidate_list) == expected
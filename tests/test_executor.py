@@ -0,0 +1,41 @@
+# encoding: utf-8
+
+import numpy as np
+import pytest
+
+from auto_module import executor as executor_module
+from auto_module.simulator import SimulatedGame
+
+
+@pytest.fixture(params=[False, True], ids=['serial', 'parallel'])
+def make_executor(request, monkeypatch, game_config):
+    monkeypatch.setattr(executor_module, 'PARALLEL_MATCH_ENABLED', request.param)
+    monkeypatch.setattr(executor_module, 'PHASH_INDEX_ENABLED', False)  # the index would be saved into the config dir
+    executor_list = []
+
+    def _make(start_state):
+        simulated_game = SimulatedGame(game_config, start_state)
+        executor = executor_module.Executor(game_config, simulated_game, simulated_game)
+        executor_list.append(executor)
+        return executor, simulated_game
+    yield _make
+    for executor in executor_list:
+        executor.close()
+
+
+def test_gradual_fade_is_reported(make_executor):
+    executor, simulated_game = make_executor('行动配置')
+    src = simulated_game.get_frame('行动配置').astype(np.float32)
+    dst = simulated_game.get_frame('LS-3选中').astype(np.float32)
+    assert executor.judge_state(src.astype(np.uint8)) == '行动配置'
+
+    step_num = 40  # every step stays under FRAME_DIFF_THRESHOLD
+    result_list = []
+    for i in range(1, step_num + 1):
+        frame = (src + (dst - src) * i / step_num).round().astype(np.uint8)
+        # polled by wait_for_action_result after clicking 开始行动
+        result_list.append(executor.judge_state(frame, 'LS-3选中'))
+    assert result_list[-1] == 'LS-3选中'
+    # the matches of the faded out screen are not taken for the new one
+    quick_key = [k for k, v in executor.state_classifier.template_dict.items() if v[1] == '快捷编队.png'][0]
+    assert executor.state_classifier.last_hit_table.get(quick_key) is None
@@ -0,0 +1,53 @@
+# encoding: utf-8
+
+import numpy as np
+
+from auto_module.image import FrameChangeDetector, FRAME_DIFF_THRESHOLD
+
+
+def test_first_frame_is_changed():
+    detector = FrameChangeDetector()
+    img = np.full((400, 800), 100, dtype=np.uint8)
+    assert detector.update(img) == [(0, 0, 800, 400)]
+    assert detector.update(img.copy()) == []
+
+
+def test_changed_tile_is_reported():
+    detector = FrameChangeDetector()
+    img = np.full((400, 800), 100, dtype=np.uint8)
+    detector.update(img)
+    changed = img.copy()
+    changed[10:40, 10:40] = 200
+    assert detector.update(changed) == [(0, 0, 100, 50)]
+
+
+def test_slow_drift_is_reported():
+    detector = FrameChangeDetector()
+    img = np.full((400, 800), 100, dtype=np.uint8)
+    detector.update(img)
+    step = FRAME_DIFF_THRESHOLD // 2
+    reported = False
+    for i in range(1, 5):
+        # every frame differs from the one before by less than the threshold
+        reported = len(detector.update(img + step * i)) > 0
+        if reported:
+            break
+    assert reported
+    assert i == 3
+    assert detector.update(img + step * i) == []
+
+
+def test_drift_of_an_unchanged_tile_adds_up():
+    detector = FrameChangeDetector()
+    img = np.full((400, 800), 100, dtype=np.uint8)
+    detector.update(img)
+    frame = img.copy()
+    step = FRAME_DIFF_THRESHOLD // 2
+    reported_list = []
+    for i in range(1, 4):
+        frame[:50, :100] = 100 + step * i  # the first tile drifts slowly
+        frame[350:, 700:] = 0 if i % 2 else 255  # the last tile changes at every frame
+        reported_list.append(detector.update(frame))
+    assert reported_list[0] == [(700, 350, 800, 400)]
+    assert reported_list[1] == [(700, 350, 800, 400)]
+    assert reported_list[2] == [(0, 0, 100, 50), (700, 350, 800, 400)]
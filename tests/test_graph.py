@@ -0,0 +1,87 @@
+# encoding: utf-8
+
+from auto_module.graph import CompactGraph
+
+
+def make_graph(edge_list):
+    """
+    :param edge_list: [(from, to, weight, predecessor or None), ...], the payload of an edge is 'from->to'
+    """
+    graph = CompactGraph()
+    for from_name, to_name, weight, predecessor in edge_list:
+        graph.add_edge(from_name, to_name, weight, '{0}->{1}'.format(from_name, to_name), predecessor)
+    return graph
+
+
+def test_predecessor_limits_the_edge():
+    graph = make_graph([
+        ('A', 'C', 1, None),
+        ('B', 'C', 1, None),
+        ('A', 'B', 5, None),
+        ('C', 'D', 1, 'B'),  # D can only be reached from C when coming from B
+    ])
+    assert graph.shortest_path_with_predecessor('A', 'D') == ['A->B', 'B->C', 'C->D']
+    assert graph.shortest_path_with_predecessor('B', 'D') == ['B->C', 'C->D']
+
+
+def test_predecessor_is_free_at_the_source():
+    graph = make_graph([('C', 'D', 1, 'B')])
+    assert graph.shortest_path_with_predecessor('C', 'D') == ['C->D']
+
+
+def test_must_have():
+    graph = make_graph([
+        ('A', 'D', 1, None),
+        ('A', 'B', 1, None),
+        ('B', 'D', 1, None),
+        ('D', 'A', 1, None),
+    ])
+    assert graph.shortest_path_with_predecessor('A', 'D') == ['A->D']
+    assert graph.shortest_path_with_predecessor('A', 'D', must_have=['B']) == ['A->B', 'B->D']
+
+
+def test_cycle_to_the_source():
+    graph = make_graph([('A', 'B', 1, None), ('B', 'A', 1, None)])
+    assert graph.shortest_path_with_predecessor('A', 'A') == ['A->B', 'B->A']
+
+
+def test_no_path_with_predecessor():
+    graph = make_graph([
+        ('A', 'C', 1, None),
+        ('C', 'D', 1, 'B'),
+        ('B', 'E', 1, None),
+    ])
+    assert graph.shortest_path_with_predecessor('A', 'D') is None
+    assert graph.shortest_path_with_predecessor('A', 'X') is None
+    assert graph.shortest_path_with_predecessor('A', 'C', must_have=['X']) is None
+
+
+def test_shortest_path_takes_the_lighter_route():
+    graph = make_graph([
+        ('A', 'B', 1, None),
+        ('B', 'D', 1, None),
+        ('A', 'C', 0.5, None),
+        ('C', 'D', 0.4, None),
+        ('A', 'D', 3, None),
+    ])
+    assert graph.shortest_path('A', 'D') == ['A->C', 'C->D']
+    assert graph.shortest_path_with_predecessor('A', 'D') == ['A->C', 'C->D']
+
+
+def test_shortest_path_keeps_parallel_edges():
+    graph = CompactGraph()
+    graph.add_edge('A', 'B', 2, 'slow')
+    graph.add_edge('A', 'B', 1, 'fast')
+    assert graph.shortest_path('A', 'B') == ['fast']
+
+
+def test_shortest_path_ignores_predecessors():
+    graph = make_graph([('A', 'C', 1, None), ('C', 'D', 1, 'B')])
+    assert graph.shortest_path('A', 'D') == ['A->C', 'C->D']
+
+
+def test_no_shortest_path():
+    graph = make_graph([('A', 'B', 1, None), ('C', 'D', 1, None)])
+    assert graph.shortest_path('A', 'D') is None
+    assert graph.shortest_path('A', 'X') is None
+    assert graph.shortest_path('A', 'A') == []
@@ -0,0 +1,82 @@
+# encoding: utf-8
+
+from auto_module.classifier import StateClassifier
+from auto_module.compiled import CompiledConfig
+from auto_module.phash import PHashIndex, get_phash, get_hamming_distance, PHASH_RADIUS, PHASH_MIN_CONFIRMATIONS
+
+
+def make_check_func(classifier, img):
+    hit_table = classifier.new_hit_table(None)
+    return lambda state_name: classifier.spot_check_state(state_name, img, hit_table)
+
+
+def add_confirmed(index, h, state_name):
+    for _ in range(PHASH_MIN_CONFIRMATIONS):
+        index.add(h, state_name)
+
+
+def test_similar_screenshots_share_the_hash(read_screenshot):
+    assert get_hamming_distance(get_phash(read_screenshot('a1.png')), get_phash(read_screenshot('a2.png'))) \
+        <= PHASH_RADIUS
+
+
+def test_lookup_needs_confirmations(tmp_path):
+    index = PHashIndex(str(tmp_path), 'signature')
+    index.add(0x1234, 'A')
+    assert index.lookup(0x1234) == (None, [])
+    index.add(0x1234, 'A')
+    assert index.lookup(0x1234 ^ 0b1011) == ('A', [])
+    assert index.lookup(0x1234 ^ 0b11111) == (None, [])  # out of the radius
+
+
+def test_lookup_checks_the_answer(tmp_path, game_config, read_screenshot):
+    classifier = StateClassifier(CompiledConfig(game_config))
+    screenshot = read_screenshot('行动配置.png')
+    # the 快捷编队 button of the state is covered by the area below it
+    covered = screenshot.copy()
+    covered[29:95, 1301:1597] = screenshot[99:165, 1301:1597]
+    h = get_phash(screenshot)
+    covered_h = get_phash(covered)
+    assert get_hamming_distance(h, covered_h) <= PHASH_RADIUS
+
+    index = PHashIndex(str(tmp_path), 'signature')
+    add_confirmed(index, h, '行动配置')
+    assert index.lookup(covered_h) == ('行动配置', [])  # unchecked, the index would take one for the other
+    state_name, rect_list = index.lookup(h, make_check_func(classifier, screenshot))
+    assert state_name == '行动配置' and (1301, 29, 1597, 95) in rect_list
+
+    assert index.lookup(covered_h, make_check_func(classifier, covered)) == (None, [])
+    assert index.get_stats()['rejects'] == 1
+    assert covered_h in index.conflict_set and h in index.conflict_set
+    assert index.lookup(h) == (None, [])
+
+
+def test_different_states_within_the_radius_conflict(tmp_path):
+    index = PHashIndex(str(tmp_path), 'signature')
+    add_confirmed(index, 0x1234, 'A')
+    index.add(0x1234 ^ 0b1, 'B')
+    assert index.conflict_set == {0x1234, 0x1234 ^ 0b1}
+    assert index.lookup(0x1234) == (None, [])
+    assert index.lookup(0x1234 ^ 0b100) == (None, [])
+    index.add(0x1234, 'A')  # a conflict stays one
+    assert 0x1234 not in index.entry_dict
+
+
+def test_reject(tmp_path):
+    index = PHashIndex(str(tmp_path), 'signature')
+    add_confirmed(index, 0x1234, 'A')
+    add_confirmed(index, 0xffff0000, 'A')
+    index.reject(0x1234 ^ 0b1)
+    assert index.lookup(0x1234) == (None, [])
+    assert index.lookup(0xffff0000) == ('A', [])
+
+
+def test_save_and_load(tmp_path):
+    index = PHashIndex(str(tmp_path), 'signature')
+    add_confirmed(index, 0x1234, 'A')
+    index.reject(0xffff0000)
+    index.save()
+    loaded = PHashIndex(str(tmp_path), 'signature')
+    assert loaded.lookup(0x1234) == ('A', [])
+    assert loaded.conflict_set == {0xffff0000}
+    assert PHashIndex(str(tmp_path), 'another signature').entry_dict == {}
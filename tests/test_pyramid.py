@@ -0,0 +1,54 @@
+# encoding: utf-8
+
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from auto_module import image
+from auto_module.image import get_matched_area_full, get_matched_area_pyramid, read_gray_img
+
+from tests.conftest import CONFIG_DIR, SCREENSHOT_DIR
+
+SCREENSHOT_LIST = ['a1.png', 'a2.png', '行动配置.png']
+TEMPLATE_LIST = sorted(glob.glob(os.path.join(CONFIG_DIR, '*', '*.png')))
+
+
+@pytest.mark.parametrize('screenshot_name', SCREENSHOT_LIST)
+def test_pyramid_agrees_with_full_match(screenshot_name):
+    screenshot = read_gray_img(os.path.join(SCREENSHOT_DIR, screenshot_name))
+    found_num = 0
+    for template_path in TEMPLATE_LIST:
+        template = read_gray_img(template_path)
+        expected = get_matched_area_full(screenshot, template)
+        assert get_matched_area_pyramid(screenshot, template) == expected, template_path
+        found_num += expected is not None
+    assert found_num > 0
+
+
+def test_pyramid_falls_back_when_the_coarse_pass_misses(monkeypatch, read_template):
+    # 1/4 of the 104x43 template off the 4 px grid correlates below PYRAMID_CANDIDATE_THRESHOLD
+    monkeypatch.setattr(image, 'PYRAMID_MIN_TEMPLATE_SIZE', 8)
+    template = read_template('CE-3选中', 'CE-3.png')
+    frame = np.full((1080, 1920), 30, dtype=np.uint8)
+    frame[500:500 + template.shape[0], 1002:1002 + template.shape[1]] = template
+    assert get_matched_area_pyramid(frame, template) == (1002, 500, 1002 + template.shape[1], 500 + template.shape[0])
+
+
+def test_pyramid_falls_back_without_candidates(monkeypatch, read_screenshot, read_template):
+    # e.g. more similar elements than PYRAMID_CANDIDATE_NUM, none of them the template
+    monkeypatch.setattr(image, 'PYRAMID_CANDIDATE_NUM', 0)
+    screenshot = read_screenshot('行动配置.png')
+    template = read_template('行动配置', '快捷编队.png')
+    assert get_matched_area_pyramid(screenshot, template) == (1301, 29, 1597, 95)
+
+
+def test_clear_miss_skips_the_full_search(monkeypatch, read_screenshot, read_template):
+    def _fail(src_image, target_image):
+        raise AssertionError('a clearly absent template should be decided by the coarse scale')
+
+    monkeypatch.setattr(image, 'get_matched_area_full', _fail)
+    screenshot = read_screenshot('行动配置.png')
+    assert get_matched_area_pyramid(screenshot, read_template('等级提升', '等级提升.png')) is None
+    assert get_matched_area_pyramid(screenshot, read_template('行动结束', '行动结束.png')) is None
@@ -0,0 +1,68 @@
+# encoding: utf-8
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from auto_module.image import ResourceImageCache
+
+
+def write_img(tmp_path, name, value, size=100):
+    img_path = os.path.join(str(tmp_path), name)
+    cv2.imwrite(img_path, np.full((size, size, 3), value, dtype=np.uint8))
+    return img_path
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResourceImageCache()
+    img_path = write_img(tmp_path, 'a.png', 10)
+    img = cache.get(img_path)
+    assert img.shape == (100, 100)
+    assert cache.get(img_path) is img
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResourceImageCache(max_bytes=25000)  # two 100x100 gray images
+    a, b, c = [write_img(tmp_path, name, 10) for name in ('a.png', 'b.png', 'c.png')]
+    cache.get(a)
+    cache.get(b)
+    cache.get(a)  # b is the least recently used now
+    cache.get(c)
+    assert list(cache.entry_dict.keys()) == [a, c]
+    assert cache.bytes == 20000
+    assert cache.evictions == 1
+
+
+def test_keeps_an_image_larger_than_the_budget(tmp_path):
+    cache = ResourceImageCache(max_bytes=5000)
+    a = write_img(tmp_path, 'a.png', 10)
+    b = write_img(tmp_path, 'b.png', 10)
+    cache.get(a)
+    cache.get(b)
+    assert list(cache.entry_dict.keys()) == [b]
+    assert cache.bytes == 10000
+
+
+def test_reloads_modified_file(tmp_path):
+    cache = ResourceImageCache(check_interval=0)
+    img_path = write_img(tmp_path, 'a.png', 10)
+    assert cache.get(img_path)[0, 0] == 10
+    write_img(tmp_path, 'a.png', 200)
+    mtime = os.path.getmtime(img_path)
+    os.utime(img_path, (mtime + 10, mtime + 10))
+    assert cache.get(img_path)[0, 0] == 200
+    assert cache.bytes == 10000
+
+
+def test_evicts_deleted_file(tmp_path):
+    cache = ResourceImageCache(check_interval=0)
+    img_path = write_img(tmp_path, 'a.png', 10)
+    cache.get(img_path)
+    os.remove(img_path)
+    with pytest.raises(OSError):
+        cache.get(img_path)
+    assert img_path not in cache.entry_dict
+    assert cache.bytes == 0
@@ -0,0 +1,148 @@
+# encoding: utf-8
+
+import pytest
+
+from auto_module.constant import STATE_TYPE
+from auto_module.model import GameConfig, GameState, GameAction
+
+
+def make_config(config_dir):
+    """
+    A -> B -> D and A -> C -> D, the route through B is cheaper by the declared costs
+    """
+    game_config = GameConfig('test', config_dir)
+    for state_name in ('A', 'B', 'C', 'D'):
+        game_config.add_state(GameState(state_name, '', config_dir, STATE_TYPE['NORMAL']))
+    for from_state, to_state, cost in (('A', 'B', 1), ('B', 'D', 1), ('A', 'C', 1.5), ('C', 'D', 1)):
+        action = GameAction(from_state + to_state, 'click', from_state + to_state + '.png', from_state, to_state,
+                            cost=cost)
+        game_config.game_state_dict[from_state].add_action(action)
+        game_config.game_action_dict[action.name] = action
+    game_config.build_graph()
+    return game_config
+
+
+def get_route(game_config, source='A', target='D'):
+    return [a.name for a in game_config.get_shortest_action_list_with_predecessor(source, target)]
+
+
+def record(game_config, action_name, latency, times=1, success=True):
+    for _ in range(times):
+        game_config.action_stats.record(game_config.game_action_dict[action_name], latency, success)
+
+
+def test_no_stats_keeps_the_declared_costs(tmp_path):
+    game_config = make_config(str(tmp_path))
+    assert not game_config.apply_action_stats()
+    assert [a.get_cost() for a in game_config.game_action_dict.values()] == [1, 1, 1.5, 1]
+
+
+def test_single_action_keeps_its_declared_cost(tmp_path):
+    game_config = make_config(str(tmp_path))
+    record(game_config, 'AC', 7.0)
+    # the latency is scaled to the declared cost of the same action, so nothing moves
+    assert not game_config.apply_action_stats()
+    assert game_config.game_action_dict['AC'].get_cost() == 1.5
+
+
+def test_learned_weights_change_the_route(tmp_path):
+    game_config = make_config(str(tmp_path))
+    assert get_route(game_config) == ['AB', 'BD']
+
+    record(game_config, 'AB', 5.0)
+    record(game_config, 'BD', 5.0)
+    record(game_config, 'AC', 1.0)
+    record(game_config, 'CD', 1.0)
+    assert game_config.apply_action_stats()
+    cost_list = [a.get_cost() for a in game_config.game_action_dict.values()]
+    assert sum(cost_list) == pytest.approx(4.5)  # the declared costs of the recorded actions
+    assert cost_list == pytest.approx([4.5 * 5 / 12, 4.5 * 5 / 12, 4.5 / 12, 4.5 / 12])
+    assert get_route(game_config) == ['AC', 'CD']
+
+
+def test_failures_make_an_action_expensive(tmp_path):
+    game_config = make_config(str(tmp_path))
+    for name in ('AB', 'BD', 'AC', 'CD'):
+        record(game_config, name, 1.0)
+    record(game_config, 'AB', 1.0, times=5, success=False)
+    game_config.apply_action_stats()
+    assert get_route(game_config) == ['AC', 'CD']
+
+
+def test_small_moves_keep_the_cached_routes(tmp_path):
+    game_config = make_config(str(tmp_path))
+    for name in ('AB', 'BD', 'AC', 'CD'):
+        record(game_config, name, 1.0)
+    game_config.apply_action_stats()
+    get_route(game_config)
+    route_dict = dict(game_config.route_dict)
+
+    record(game_config, 'AB', 1.05)  # within ACTION_STATS_WEIGHT_TOLERANCE
+    assert not game_config.apply_action_stats()
+    assert game_config.route_dict == route_dict
+
+
+def test_stats_persist_across_reloads(tmp_path):
+    game_config = make_config(str(tmp_path))
+    record(game_config, 'AB', 5.0)
+    record(game_config, 'AC', 1.0)
+    game_config.apply_action_stats()
+    game_config.action_stats.save()
+
+    reloaded = make_config(str(tmp_path))
+    assert reloaded.apply_action_stats()
+    assert [a.get_cost() for a in reloaded.game_action_dict.values()] == \
+        pytest.approx([a.get_cost() for a in game_config.game_action_dict.values()])
+    assert get_route(reloaded) == ['AC', 'CD']
+
+
+def test_cached_routes_follow_edited_costs(tmp_path):
+    game_config = make_config(str(tmp_path))
+    assert get_route(game_config) == ['AB', 'BD']
+
+    game_config.game_action_dict['AB'].cost = 5
+    assert get_route(game_config) == ['AB', 'BD']  # served from route_dict until the editor invalidates it
+    game_config.invalidate_routes()
+    assert get_route(game_config) == ['AC', 'CD']
+
+
+def test_cached_routes_follow_edited_targets(tmp_path):
+    game_config = make_config(str(tmp_path))
+    assert get_route(game_config, 'A', 'B') == ['AB']
+
+    game_config.game_action_dict['AB'].to_state = 'C'
+    game_config.game_action_dict['AC'].to_state = 'B'
+    game_config.invalidate_routes()
+    assert get_route(game_config, 'A', 'B') == ['AC']
+    assert get_route(game_config) == ['AB', 'CD']
+
+
+class FakeItem:
+    def __init__(self, text):
+        self.value = text
+
+    def text(self):
+        return self.value
+
+    def setText(self, text):
+        self.value = text
+
+
+class FakeListWidget:
+    def __init__(self, text):
+        self.item = FakeItem(text)
+
+    def currentItem(self):
+        return self.item
+
+
+def test_editor_action_save_drops_cached_routes(tmp_path):
+    GameConfigWidget = pytest.importorskip('gui.GameConfigWidget').GameConfigWidget
+    game_config = make_config(str(tmp_path))
+    assert get_route(game_config, 'A', 'C') == ['AC']
+
+    widget = type('FakeWidget', (), {})()
+    widget.current_config = game_config
+    widget.action_listWidget = FakeListWidget('AB')
+    GameConfigWidget.save_game_action(widget, {'name': 'AB', 'from': 'A', 'to': 'C', 'condition': 'AB', 'img': None})
+    assert get_route(game_config, 'A', 'C') == ['AB']